@@ -0,0 +1,71 @@
+import re
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from .sharding import HashRing
+
+_ring = None
+
+# ws/room/<room_id>/, the one-step connect URL
+_ROOM_PATH = re.compile(r'/ws/room/([A-Z]+)/$')
+
+
+def workers():
+    return getattr(settings, 'ROOM_WORKERS', None) or []
+
+
+def enabled():
+    """Room affinity is on when this process is one of several pinned workers."""
+    return bool(workers() and getattr(settings, 'WORKER_ADDRESS', None))
+
+
+def ring():
+    global _ring
+    if _ring is None or _ring.nodes != workers():
+        _ring = HashRing(workers())
+    return _ring
+
+
+def worker_for(room_id):
+    return ring().node_for(room_id)
+
+
+def owns_room(room_id):
+    """Whether room_id is pinned to this worker. Always true without affinity."""
+    if not enabled():
+        return True
+    return worker_for(room_id) == settings.WORKER_ADDRESS
+
+
+def room_from_query(query_string):
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode('latin-1')
+    values = parse_qs(query_string).get('room')
+    return values[0] if values else None
+
+
+def room_from_path(path):
+    match = _ROOM_PATH.search(path or '')
+    return match.group(1) if match else None
+
+
+class RoomAffinityMiddleware:
+    """
+    Reads the room a socket is headed for from its path or `?room=` into scope['room_id']
+    and refuses sockets for rooms pinned to another worker, so a room's
+    sockets always share one process and its group traffic stays local.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            room_id = room_from_path(scope.get('path')) or room_from_query(scope.get('query_string', b''))
+            if room_id and not owns_room(room_id):
+                await receive()
+                await send({'type': 'websocket.close', 'code': 4003})
+                return
+            scope = dict(scope, room_id=room_id)
+        return await self.app(scope, receive, send)
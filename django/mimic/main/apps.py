@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        from django.conf import settings
+        from .metrics import metrics
+        from .models import room_ids
+
+        metrics.enabled = getattr(settings, 'METRICS_ENABLED', False)
+
+        node = getattr(settings, 'ROOM_ID_NODE', None)
+        if node is not None:
+            room_ids.node = node % len(room_ids.alphabet)
@@ -1,32 +1,22 @@
+import asyncio
+import math
+import time
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from . import affinity, fanout, services
+from .decks import deck_exists
+from .log import get_logger
+from .metrics import metrics
 from .models import Room
-import json
-
-charadesEmojis = [
-
-  "🏃‍♂️", "🕺", "🧘", "🛏️", "🍽️", "🧼", "📖", "🧹", "🚶", "🏊",
-
-
-  "😂", "😢", "😡", "😱", "😴", "🤔", "😍", "🤢", "🤯", "😇",
-
-
-  "👮", "👨‍🍳", "👨‍⚕️", "👨‍🏫", "🕵️", "👨‍🎤", "👩‍🚀", "🤹", "🧙", "🧛",
-
-
-  "🎤", "🎸", "🎮", "🎧", "🎥", "📺", "🎭", "📚", "🎨", "🎲",
-
-
-  "📱", "📷", "🪑", "🛏️", "🚪", "🧴", "🧸", "🎒", "🕰️", "🔑",
-
+from .outbox import SLOW_CLOSE_CODE, Outbox, server_buffer
+from .packs import DEFAULT_PACK, packs
+from .protocol import COMPACT, TYPE_CODES, ProtocolError, decode, negotiate
+from .ratelimit import guess_bucket
+from .resume import make_token, read_token, resume_grace
+from .rounds import clock
 
-  "🏠", "🏫", "🏥", "🏖️", "🌋", "🌲", "🗻", "🌧️", "🌞", "🌪️",
-
-
-  "🐶", "🐱", "🐍", "🐘", "🐒", "🦁", "🐴", "🐧", "🐟", "🐔",
-
-  "🚗", "🚕", "🚌", "🚑", "🚀", "🛸", "🛶", "🚲", "✈️", "🚁"
-]
+log = get_logger(__name__)
 
 
 class RoomConsumer(AsyncWebsocketConsumer):
@@ -34,36 +24,64 @@ class RoomConsumer(AsyncWebsocketConsumer):
         self.room = None
         self.username = ""
         self.room_group_name = None
+        self.codec = negotiate(self.scope.get('subprotocols'))
+        self.roster_deltas = False
+        self.guess_batches = False
+        self.guess_bucket = guess_bucket('socket')
+        self.throttled = False
+        # Everything this socket is sent goes through here, so a slow reader never holds up the room
+        self.outbox = Outbox.from_settings(self.send, self.frame_dropped, self.evict, server_buffer(self.base_send))
         
-        await self.accept()
+        await self.accept(subprotocol=self.codec.subprotocol)
+        if metrics.enabled:
+            metrics.sockets.inc()
+            self.counted = True
+
+        # One-step connect: with the identity in the URL the join's reply is the first frame
+        params = parse_qs(self.scope.get('query_string', b'').decode('latin-1'))
+        token = params.get('resume_token', [None])[0]
+        username = params.get('username', [None])[0]
+        room_id = self.scope.get('url_route', {}).get('kwargs', {}).get('room_id') or self.scope.get('room_id')
+        flags = {
+            'deltas': params.get('deltas', ['0'])[0] == '1',
+            'batches': params.get('batches', ['0'])[0] == '1'
+        }
+        if token:
+            await self.handle_message({'type': 'resume', 'resume_token': token, **flags})
+        elif username and room_id:
+            await self.handle_message({'type': 'user', 'username': username, **flags})
+            await self.handle_message({'type': 'join_room', 'room_id': room_id})
+        if token or username and room_id:
+            if self.room and 'seq' in params:
+                await self.replay_since(params['seq'][0])
+            return
         
         # Send request for initial data
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'connection_ready',
             'message': 'ready'
-        }))
+        })
 
     async def disconnect(self, close_code):
+        if hasattr(self, 'outbox'):
+            self.outbox.close()
+        if getattr(self, 'counted', False):
+            metrics.sockets.dec()
+            self.counted = False
+        # A dropped socket may be back with its resume token; only then does the room hear of it
+        await self.leave_room(grace=resume_grace())
+
+    async def leave_room(self, grace=0):
         if self.room and self.username and self.room_group_name:
-            # Remove user from participants
-            if self.username in self.room.participants:
-                self.room.participants.remove(self.username)
-                await self.room.asave()
-                
-                # Notify all users in the room about the departure
-                if self.channel_layer:
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'participants_updated',
-                            'participants': self.room.participants,
-                            'room_id': self.room.id,
-                            'action': 'user_left',
-                            'username': self.username
-                        }
-                    )
+            if self.codec is COMPACT:
+                self.room.compact_sockets -= 1
+
+            # Remove user from participants once their last socket is gone
+            if services.detach(self.room, self.username):
+                if grace:
+                    services.depart_later(self.room, self.username, grace)
                 else:
-                    print("Warning: Channel layer not available for group send")
+                    await services.depart(self.room, self.username)
             
             # Leave room group
             if self.channel_layer:
@@ -72,18 +90,96 @@ class RoomConsumer(AsyncWebsocketConsumer):
                     self.channel_name
                 )
             else:
-                print("Warning: Channel layer not available for group discard")
+                log.warning('channel_layer_missing', operation='group_discard')
+        self.room = None
+        self.room_group_name = None
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = decode(text_data, bytes_data)
+        except (ProtocolError, ValueError):
+            await self.send_payload({
+                'type': 'error',
+                'message': 'Malformed message'
+            })
+            return
+        log.debug('message_received', type=data.get('type'), username=self.username)
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        print(f"Received data: {data}")
+        if not metrics.enabled:
+            await self.handle_message(data)
+            return
+        start = time.perf_counter()
+        try:
+            await self.handle_message(data)
+        finally:
+            kind = data.get('type')
+            # Clients choose the type; anything unknown shares one series
+            metrics.messages.observe_since(start, kind if kind in TYPE_CODES else 'unknown')
 
+    async def handle_message(self, data):
         if data['type'] == 'user':
-            self.username = data['username']
+            username = data.get('username')
+            if not services.valid_username(username):
+                await self.send_payload({
+                    'type': 'error',
+                    'message': 'Invalid username'
+                })
+                return
+            if self.room and username != self.username:
+                # The room counts this socket under its current name
+                await self.send_payload({
+                    'type': 'error',
+                    'message': 'Cannot change username while in a room'
+                })
+                return
+            self.username = username
+            # Clients that track the roster version get added/removed deltas instead of full lists
+            self.roster_deltas = bool(data.get('deltas'))
+            # Clients that understand guesses_batch get a window's wrong guesses in one frame
+            self.guess_batches = bool(data.get('batches'))
+
+        elif data['type'] in ('create_room', 'join_room') and not self.username:
+            await self.send_payload({
+                'type': 'error',
+                'message': 'Send a username first'
+            })
+
+        elif data['type'] == 'roster_sync':
+            if self.room:
+                try:
+                    version = int(data.get('version', 0))
+                except (TypeError, ValueError, OverflowError):
+                    await self.send_payload({
+                        'type': 'error',
+                        'message': 'Invalid roster version'
+                    })
+                    return
+                await self.send_roster_since(version)
 
         elif data['type'] == 'create_room':
-            self.room = await Room.objects.acreate()
+            pack = data.get('pack', DEFAULT_PACK)
+            deck = data.get('deck', 'all')
+            if not packs.exists(pack):
+                await self.send_payload({
+                    'type': 'error',
+                    'message': 'Unknown emoji pack'
+                })
+                return
+            if not deck_exists(deck, pack):
+                await self.send_payload({
+                    'type': 'error',
+                    'message': 'Unknown deck'
+                })
+                return
+
+            # A socket is in at most one room
+            await self.leave_room()
+
+            self.room, version = await services.create_room(self.username, deck, pack)
             self.room_group_name = f'room_{self.room.id}'
+            services.attach(self.room, self.username)
+            if self.codec is COMPACT:
+                self.room.compact_sockets += 1
             
             # Join room group
             if self.channel_layer:
@@ -92,40 +188,51 @@ class RoomConsumer(AsyncWebsocketConsumer):
                     self.channel_name
                 )
             else:
-                print("Warning: Channel layer not available for group add")
-            
-            # Add user to participants
-            self.room.participants.append(self.username)
-            await self.room.asave()
+                log.warning('channel_layer_missing', operation='group_add')
             
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'room_created',
                 'room_id': self.room.id,
                 'participants': self.room.participants,
+                'version': self.room.roster_version,
                 'timer': self.room.timer,
-                'rounds': self.room.rounds
-            }))
+                'rounds': self.room.rounds,
+                'deck': deck,
+                'pack': pack,
+                'resume_token': make_token(self.room.id, self.username)
+            })
             
             # Notify all users in the room about participants change
-            if self.channel_layer:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'participants_updated',
-                        'participants': self.room.participants,
-                        'room_id': self.room.id,
-                        'action': 'user_joined',
-                        'username': self.username
-                    }
-                )
-            else:
-                print("Warning: Channel layer not available for group send")
+            await fanout.broadcast_roster(self.room, self.username, 'user_joined', version)
         
         elif data['type'] == 'join_room':
-            room_id = data['room_id']
+            room_id = data.get('room_id')
+            if not isinstance(room_id, str):
+                await self.send_payload({
+                    'type': 'error',
+                    'message': 'Room does not exist'
+                })
+                return
+            if not affinity.owns_room(room_id):
+                # Sockets of a room must share a worker; the client reconnects with ?room=
+                await self.send_payload({
+                    'type': 'error',
+                    'message': 'Room is served by another worker, reconnect with ?room=' + room_id,
+                    'reconnect': True,
+                    'room_id': room_id
+                })
+                return
+            if self.room and self.room.id != room_id:
+                await self.leave_room()
             try:
-                self.room = await Room.objects.aget(id=room_id)
+                rejoin = self.room is not None
+                # Add user to participants if not already there
+                self.room, joined, version = await services.join_room(room_id, self.username)
                 self.room_group_name = f'room_{self.room.id}'
+                if not rejoin:
+                    services.attach(self.room, self.username)
+                    if self.codec is COMPACT:
+                        self.room.compact_sockets += 1
                 
                 # Join room group
                 if self.channel_layer:
@@ -134,177 +241,240 @@ class RoomConsumer(AsyncWebsocketConsumer):
                         self.channel_name
                     )
                 else:
-                    print("Warning: Channel layer not available for group add")
-                
-                # Add user to participants if not already there
-                if self.username not in self.room.participants:
-                    self.room.participants.append(self.username)
-                    await self.room.asave()
+                    log.warning('channel_layer_missing', operation='group_add')
                 
-                await self.send(text_data=json.dumps({
-                    'type': 'joined_room',
-                    'room_id': self.room.id,
-                    'participants': self.room.participants,
-                    'timer': self.room.timer,
-                    'rounds': self.room.rounds
-                }))
+                await self.send_payload(self.room_snapshot('joined_room'))
                 
                 # Notify all users in the room about participants change
-                if self.channel_layer:
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'participants_updated',
-                            'participants': self.room.participants,
-                            'room_id': self.room.id,
-                            'action': 'user_joined',
-                            'username': self.username
-                        }
-                    )
-                else:
-                    print("Warning: Channel layer not available for group send")
+                if joined:
+                    await fanout.broadcast_roster(self.room, self.username, 'user_joined', version)
                 
             except Room.DoesNotExist:
-                await self.send(text_data=json.dumps({
+                await self.send_payload({
                     'type': 'error',
                     'message': 'Room does not exist'
-                }))
-        elif data['type'] == 'start_game':
-            # get random participant
-            #get random emoji
-            if self.room and self.room.participants:
-                import random
-                self.room.currentTurn = random.choice(self.room.participants)
-                self.room.currentEmoji = random.choice(charadesEmojis)
-                self.room.gameState = 'in_progress'
-                await self.room.asave()
-                
-                # Send different messages based on whether this user is the chosen participant
-                if self.username == self.room.currentTurn:
-                    # This user is the chosen participant - send them the emoji
-                    await self.send(text_data=json.dumps({
-                        'type': 'game_started',
-                        'current_turn': self.room.currentTurn,
-                        'room_id': self.room.id,
-                        'role': 'actor',
-                        'emoji': self.room.currentEmoji
-                    }))
-                else:
-                    # This user is a guesser
-                    await self.send(text_data=json.dumps({
-                        'type': 'game_started',
-                        'current_turn': self.room.currentTurn,
-                        'room_id': self.room.id,
-                        'role': 'guesser'
-                    }))
-                
-                # Notify all users in the room about game start
+                })
+        elif data['type'] == 'resume':
+            session = read_token(data.get('resume_token'))
+            if session is None:
+                await self.send_payload({
+                    'type': 'error',
+                    'message': 'Session cannot be resumed'
+                })
+                return
+            room_id, username = session
+            if self.room and (self.room.id != room_id or self.username != username):
+                await self.leave_room()
+            if self.room is None:
+                room = services.resume(room_id, username)
+                if room is None:
+                    # Past the grace window, or the room is held by another worker: user and join_room as usual
+                    await self.send_payload({
+                        'type': 'error',
+                        'message': 'Session cannot be resumed'
+                    })
+                    return
+                self.room = room
+                self.room_group_name = f'room_{room.id}'
+                if self.codec is COMPACT:
+                    room.compact_sockets += 1
+
                 if self.channel_layer:
-                    await self.channel_layer.group_send(
+                    await self.channel_layer.group_add(
                         self.room_group_name,
-                        {
-                            'type': 'game_started_broadcast',
-                            'current_turn': self.room.currentTurn,
-                            'room_id': self.room.id,
-                            'emoji': self.room.currentEmoji
-                        }
+                        self.channel_name
                     )
                 else:
-                    print("Warning: Channel layer not available for group send")
+                    log.warning('channel_layer_missing', operation='group_add')
+            self.username = username
+            self.roster_deltas = bool(data.get('deltas'))
+            self.guess_batches = bool(data.get('batches'))
+
+            await self.send_payload(self.room_snapshot('resumed'))
+            if 'seq' in data:
+                await self.replay_since(data['seq'])
+
+        elif data['type'] == 'replay':
+            if self.room:
+                await self.replay_since(data.get('seq'))
+        elif data['type'] == 'start_game':
+            if self.room and self.room.participants:
+                if not services.start_game(self.room):
+                    await self.send_payload({
+                        'type': 'error',
+                        'message': 'Game already in progress'
+                    })
+                    return
+
+                # Everyone in the room, this socket included, learns their role from one broadcast
+                await fanout.broadcast_game_started(self.room, self.room.timer)
         elif data['type'] == 'submit_guess':
+            if self.guess_bucket is not None and not self.guess_bucket.take():
+                # Dropped unread; only the first drop of a burst is answered
+                if not self.throttled:
+                    self.throttled = True
+                    await self.send_payload({
+                        'type': 'rate_limited',
+                        'retry_after': math.ceil(self.guess_bucket.retry_after() * 1000)
+                    })
+                return
+            self.throttled = False
+
             # Handle guess submission
             guess = data.get('guess', '')
-            if self.room and self.room.currentEmoji and guess:
-                is_correct = guess == self.room.currentEmoji
+            if self.room and self.room.currentEmoji and guess and guess not in self.room.deck.catalog:
+                # Nothing outside the game's emojis can be right, so it never reaches the room
+                await self.send_payload({
+                    'type': 'guess_result',
+                    'correct': False,
+                    'error': True,
+                    'guess': guess,
+                    'message': '⚠️ That emoji isn\'t in the game!'
+                })
+            elif self.room and self.room.currentEmoji and guess and self.username != self.room.currentTurn:
+                # Scored, and the turn moved on, before anything is sent
+                is_correct, points, ended = services.submit_guess(self.room, self.username, guess)
                 
                 # Send response to the guesser
                 if is_correct:
-                    await self.send(text_data=json.dumps({
+                    await self.send_payload({
                         'type': 'guess_result',
                         'correct': True,
                         'guess': guess,
-                        'correct_emoji': self.room.currentEmoji,
+                        'correct_emoji': guess,
+                        'points': points,
                         'message': '🎉 Correct! You guessed it!'
-                    }))
+                    })
                 else:
-                    await self.send(text_data=json.dumps({
+                    await self.send_payload({
                         'type': 'guess_result',
                         'correct': False,
                         'guess': guess,
                         'message': '❌ Incorrect guess. Try again!',
                         'hint': f'You guessed {guess}, but that\'s not right.'
-                    }))
+                    })
                 
-                # Notify all users about the guess
-                if self.channel_layer:
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'guess_submitted',
-                            'username': self.username,
-                            'guess': guess,
-                            'correct': is_correct,
-                            'room_id': self.room.id,
-                            'message': '🎉 Correct guess!' if is_correct else f'❌ {self.username} guessed {guess} - incorrect'
-                        }
-                    )
-                else:
-                    print("Warning: Channel layer not available for group send")
+                # Notify all users about the guess; wrong ones past the room's budget stay with the guesser
+                if is_correct or self.room.guess_bucket is None or self.room.guess_bucket.take():
+                    await fanout.broadcast_guess(self.room, {
+                        'type': 'guess_submitted',
+                        'username': self.username,
+                        'guess': guess,
+                        'correct': is_correct,
+                        'room_id': self.room.id,
+                        'message': '🎉 Correct guess!' if is_correct else f'❌ {self.username} guessed {guess} - incorrect'
+                    })
+
+                if ended is not None:
+                    await services.announce_turn_end(self.room, *ended)
             else:
                 # Handle invalid guess submission
-                await self.send(text_data=json.dumps({
+                await self.send_payload({
                     'type': 'guess_result',
                     'correct': False,
                     'error': True,
                     'message': '⚠️ Please enter a valid emoji guess!'
-                }))
+                })
 
-    # Handler for participants_updated group messages
-    async def participants_updated(self, event):
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'participants_updated',
-            'participants': event['participants'],
-            'room_id': event['room_id'],
-            'action': event['action'],
-            'username': event['username']
-        }))
+    async def send_payload(self, payload):
+        self.outbox.put(self.codec.encode(payload))
 
-    # Handler for game_started_broadcast group messages
-    async def game_started_broadcast(self, event):
-        # Send different messages based on whether this user is the chosen participant
-        if self.username == event['current_turn']:
-            # This user is the chosen participant - send them the emoji
-            await self.send(text_data=json.dumps({
-                'type': 'game_started',
-                'current_turn': event['current_turn'],
-                'room_id': event['room_id'],
-                'role': 'actor',
-                'emoji': event['emoji']
-            }))
-        else:
-            # This user is a guesser
-            await self.send(text_data=json.dumps({
-                'type': 'game_started',
-                'current_turn': event['current_turn'],
-                'room_id': event['room_id'],
-                'role': 'guesser'
-            }))
+    def frame_dropped(self):
+        if self.room is not None:
+            self.room.dropped_frames += 1
+        if metrics.enabled:
+            metrics.outbox_dropped.inc()
 
-    # Handler for guess_submitted group messages
-    async def guess_submitted(self, event):
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'guess_submitted',
-            'username': event['username'],
-            'guess': event['guess'],
-            'correct': event['correct'],
-            'room_id': event['room_id'],
-            'message': event.get('message', '')
-        }))
+    def evict(self, queued):
+        """Close a socket that stopped keeping up with its room."""
+        if self.room is not None:
+            self.room.evicted_sockets += 1
+        log.warning('slow_socket_evicted', room_id=self.room.id if self.room else None,
+                    username=self.username, queued=queued,
+                    room_evictions=self.room.evicted_sockets if self.room else None,
+                    room_dropped_frames=self.room.dropped_frames if self.room else None)
+        if metrics.enabled:
+            metrics.evictions.inc()
+        asyncio.ensure_future(self.close(code=SLOW_CLOSE_CODE))
 
+    def room_snapshot(self, type):
+        """A type message with everything this socket needs to pick up the room, its turn included."""
+        room = self.room
+        payload = {
+            'type': type,
+            'room_id': room.id,
+            'username': self.username,
+            'participants': room.participants,
+            'version': room.roster_version,
+            'seq': room.events.seq,
+            'timer': room.timer,
+            'rounds': room.rounds,
+            'resume_token': make_token(room.id, self.username)
+        }
+        if room.game is not None:
+            payload['current_turn'] = room.currentTurn
+            payload['round'] = room.currentRound
+            payload['scores'] = room.game.scores.as_dict()
+            payload['time_left'] = clock.time_left(room)
+            payload['role'] = 'actor' if self.username == room.currentTurn else 'guesser'
+            if self.username == room.currentTurn:
+                payload['emoji'] = room.currentEmoji
+        return payload
 
+    async def replay_since(self, seq):
+        """Send this socket the room's broadcasts after seq that the ring still holds."""
+        try:
+            seq = int(seq)
+        except (TypeError, ValueError, OverflowError):
+            seq = 0
+        for event in self.room.events.since(seq):
+            # Asked for, so none of it is dropped as feed
+            await getattr(self, event['type'])(dict(event, feed=False))
 
+    async def send_roster_since(self, version):
+        """Catch a delta client up from version: one merged delta, or a snapshot if the log is too short."""
+        changes = self.room.roster_changes_since(version)
+        if changes is None:
+            await self.send_payload({
+                'type': 'participants_snapshot',
+                'room_id': self.room.id,
+                'version': self.room.roster_version,
+                'participants': self.room.participants
+            })
+            return
+        added, removed = changes
+        await self.send_payload({
+            'type': 'participants_updated',
+            'room_id': self.room.id,
+            'version': self.room.roster_version,
+            'added': added,
+            'removed': removed
+        })
 
+    # Handler for room-wide frames that were encoded by the sender
+    async def room_broadcast(self, event):
+        self.outbox.put(self.codec.frame(event['frames']), event.get('feed', False), event.get('key'))
 
+    # Handler for roster_broadcast group messages
+    async def roster_broadcast(self, event):
+        if self.roster_deltas:
+            self.outbox.put(self.codec.frame(event['delta']))
+        else:
+            self.outbox.put(self.codec.frame(event['full']))
 
+    # Handler for guesses_broadcast group messages
+    async def guesses_broadcast(self, event):
+        feed = event.get('feed', True)
+        if self.guess_batches:
+            self.outbox.put(self.codec.frame(event['batch']), feed)
+        else:
+            for single in event['single']:
+                self.outbox.put(self.codec.frame(single), feed)
+
+    # Handler for game_started_broadcast group messages
+    async def game_started_broadcast(self, event):
+        # Only the chosen participant gets the variant carrying the emoji
+        if self.username == event['current_turn']:
+            self.outbox.put(self.codec.frame(event['actor']))
+        else:
+            self.outbox.put(self.codec.frame(event['guesser']))
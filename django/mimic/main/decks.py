@@ -0,0 +1,145 @@
+import random
+
+from django.conf import settings
+
+from .packs import DEFAULT_PACK, packs
+
+
+def deck_pools(catalog):
+    """
+    Catalog positions each deck of a pack deals from, by deck name.
+
+    'all' is the whole pack and every category of it is a deck of its own.
+    settings.EMOJI_DECKS adds weighted decks as {name: {category: copies}},
+    a category with weight 2 coming up twice per shuffle; such a deck is
+    offered by the packs that have all of its categories.
+    """
+    pools = {'all': tuple(range(len(catalog)))}
+    pools.update(catalog.categories)
+    for name, weights in getattr(settings, 'EMOJI_DECKS', {}).items():
+        if not set(weights) <= set(catalog.categories):
+            continue
+        pools[name] = tuple(
+            index
+            for category, copies in weights.items()
+            for index in catalog.categories[category] * copies
+        )
+    return pools
+
+
+_pools = {}
+
+
+def pool_for(name, pack=DEFAULT_PACK):
+    """Positions dealt by the deck called name in pack. Raises KeyError for unknown decks and packs."""
+    pools = _pools.get(pack)
+    if pools is None:
+        pools = _pools[pack] = deck_pools(packs.get(pack))
+    return pools[name]
+
+
+def deck_exists(name, pack=DEFAULT_PACK):
+    if not isinstance(name, str) or not packs.exists(pack):
+        return False
+    try:
+        pool_for(name, pack)
+    except KeyError:
+        return False
+    return True
+
+
+class Deck:
+    """
+    Deals a room's emojis without replacement.
+
+    The shuffled order is a permutation of the pool rebuilt from seed, so the
+    whole deck is captured by dumps() as pack, name, seed and position and survives
+    a worker restart. Each draw is one index step; the pool is only shuffled
+    again once it runs out.
+    """
+
+    __slots__ = ('pack', 'name', 'seed', 'position', '_order')
+
+    # Reshuffles tried before accepting one that repeats the last emoji dealt
+    reshuffle_attempts = 8
+
+    def __init__(self, name='all', seed=None, position=0, pack=DEFAULT_PACK):
+        self.pack = pack
+        self.name = name
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.position = position
+        self._order = None
+
+    @property
+    def catalog(self):
+        return packs.get(self.pack)
+
+    @property
+    def order(self):
+        if self._order is None:
+            self._order = self._shuffle(pool_for(self.name, self.pack), self.seed)
+        return self._order
+
+    @staticmethod
+    def _shuffle(pool, seed):
+        order = list(pool)
+        random.Random(seed).shuffle(order)
+        # Weighted decks hold copies; keep them from landing back to back
+        for i in range(1, len(order)):
+            if order[i] == order[i - 1]:
+                j = Deck._swap_for(order, i)
+                if j is not None:
+                    order[i], order[j] = order[j], order[i]
+        return order
+
+    @staticmethod
+    def _swap_for(order, i):
+        """Where to move order[i], a copy of the emoji before it, from; None if nowhere fits."""
+        value = order[i]
+        for j in range(i + 1, len(order)):
+            if order[j] != value:
+                return j
+        # Only copies are left after it, so put it in an earlier gap between other emojis
+        for j in range(i - 2, -1, -1):
+            if order[j] != value and order[j + 1] != value and (j == 0 or order[j - 1] != value):
+                return j
+        return None
+
+    def draw(self):
+        """Deal the next emoji."""
+        order = self.order
+        if self.position >= len(order):
+            self._reshuffle(avoid=order[-1] if order else None)
+            order = self._order
+        index = order[self.position]
+        self.position += 1
+        return self.catalog.emojis[index]
+
+    def _reshuffle(self, avoid):
+        pool = pool_for(self.name, self.pack)
+        for _ in range(self.reshuffle_attempts):
+            self.seed = random.getrandbits(32)
+            self._order = self._shuffle(pool, self.seed)
+            if len(self._order) < 2 or self._order[0] != avoid:
+                break
+        self.position = 0
+
+    def dumps(self):
+        return f'{self.pack}/{self.name}:{self.seed}:{self.position}'
+
+    @classmethod
+    def loads(cls, state, name='all', pack=DEFAULT_PACK):
+        """Restore a deck from dumps(); anything unreadable or stale starts a fresh deck of name."""
+        try:
+            deck, seed, position = state.rsplit(':', 2)
+            if '/' in deck:
+                pack, name = deck.split('/', 1)
+            else:
+                name = deck
+            deck = cls(name, int(seed), int(position), pack)
+            deck.order
+        except (AttributeError, KeyError, ValueError):
+            if not deck_exists(name, pack):
+                name, pack = 'all', (pack if packs.exists(pack) else DEFAULT_PACK)
+            return cls(name, pack=pack)
+        return deck
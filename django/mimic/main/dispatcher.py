@@ -0,0 +1,77 @@
+import asyncio
+import itertools
+from urllib.parse import urlsplit
+
+from .affinity import room_from_path, room_from_query
+from .sharding import HashRing
+
+
+class Dispatcher:
+    """
+    TCP front for several Daphne workers.
+
+    It reads only the HTTP request head, picks the worker that owns the
+    room of the request (ws/room/<room_id>/ or `?room=`) (any worker, in turn, when there is none) and
+    then splices bytes both ways without looking at them again.
+    """
+
+    max_head = 16 * 1024
+
+    def __init__(self, workers):
+        self.workers = list(workers)
+        self.ring = HashRing(self.workers)
+        self._next = itertools.cycle(self.workers)
+
+    def pick(self, target):
+        parts = urlsplit(target)
+        room_id = room_from_path(parts.path) or room_from_query(parts.query)
+        if room_id:
+            return self.ring.node_for(room_id)
+        return next(self._next)
+
+    async def handle(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        try:
+            target = head.split(b'\r\n', 1)[0].split(b' ')[1].decode('latin-1')
+        except IndexError:
+            writer.close()
+            return
+
+        host, _, port = self.pick(target).rpartition(':')
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, int(port))
+        except OSError:
+            writer.write(b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            writer.close()
+            return
+
+        upstream_writer.write(head)
+        await asyncio.gather(
+            self._pipe(reader, upstream_writer),
+            self._pipe(upstream_reader, writer),
+        )
+
+    async def _pipe(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(workers, host='0.0.0.0', port=8000):
+    dispatcher = Dispatcher(workers)
+    server = await asyncio.start_server(dispatcher.handle, host, port, limit=Dispatcher.max_head)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,96 @@
+import random
+
+# Emojis players can be asked to act out, by category
+charadesCategories = {
+
+  'actions': ["🏃‍♂️", "🕺", "🧘", "🛏️", "🍽️", "🧼", "📖", "🧹", "🚶", "🏊"],
+
+
+  'emotions': ["😂", "😢", "😡", "😱", "😴", "🤔", "😍", "🤢", "🤯", "😇"],
+
+
+  'people': ["👮", "👨‍🍳", "👨‍⚕️", "👨‍🏫", "🕵️", "👨‍🎤", "👩‍🚀", "🤹", "🧙", "🧛"],
+
+
+  'entertainment': ["🎤", "🎸", "🎮", "🎧", "🎥", "📺", "🎭", "📚", "🎨", "🎲"],
+
+
+  'objects': ["📱", "📷", "🪑", "🛏️", "🚪", "🧴", "🧸", "🎒", "🕰️", "🔑"],
+
+
+  'places': ["🏠", "🏫", "🏥", "🏖️", "🌋", "🌲", "🗻", "🌧️", "🌞", "🌪️"],
+
+
+  'animals': ["🐶", "🐱", "🐍", "🐘", "🐒", "🦁", "🐴", "🐧", "🐟", "🐔"],
+
+  'vehicles': ["🚗", "🚕", "🚌", "🚑", "🚀", "🛸", "🛶", "🚲", "✈️", "🚁"],
+}
+
+# Variation selectors and skin tone modifiers don't change which emoji it is
+_IGNORED = dict.fromkeys([0xFE0E, 0xFE0F, *range(0x1F3FB, 0x1F400)])
+# Nor does a ZWJ gender sign ("🏃‍♂️" is still "🏃")
+_GENDER_SIGNS = ('\u200d\u2642', '\u200d\u2640')
+
+
+def normalize(emoji):
+    """Key under which spellings of the same emoji compare equal."""
+    key = emoji.strip().translate(_IGNORED)
+    for sign in _GENDER_SIGNS:
+        key = key.replace(sign, '')
+    return key.strip('\u200d')
+
+
+class EmojiCatalog:
+    """
+    Deduplicated emojis with their categories, indexed by normalized key.
+
+    Each emoji has a position in emojis; index_of maps any spelling of it to
+    that position, so checking a guess is one normalize and one dict lookup.
+    """
+
+    def __init__(self, categories):
+        emojis = []
+        category_of = []
+        self._index = {}
+        for category, entries in categories.items():
+            for emoji in entries:
+                key = normalize(emoji)
+                if key in self._index:
+                    continue
+                self._index[key] = len(emojis)
+                emojis.append(emoji)
+                category_of.append(category)
+        self.emojis = tuple(emojis)
+        self.category_of = tuple(category_of)
+        self.categories = {
+            category: tuple(i for i, c in enumerate(category_of) if c == category)
+            for category in categories
+        }
+        self.keys = frozenset(self._index)
+
+    def __len__(self):
+        return len(self.emojis)
+
+    def __contains__(self, emoji):
+        return isinstance(emoji, str) and normalize(emoji) in self.keys
+
+    def index_of(self, emoji):
+        """Position of emoji in the catalog, or None if it isn't in it."""
+        if not isinstance(emoji, str):
+            return None
+        return self._index.get(normalize(emoji))
+
+    def matches(self, guess, emoji):
+        """Whether guess names emoji, however either is spelled."""
+        index = self.index_of(guess)
+        return index is not None and index == self.index_of(emoji)
+
+    def category(self, emoji):
+        index = self.index_of(emoji)
+        return None if index is None else self.category_of[index]
+
+    def random(self):
+        return self.emojis[random.randrange(len(self.emojis))]
+
+
+catalog = EmojiCatalog(charadesCategories)
@@ -0,0 +1,148 @@
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .log import get_logger
+from .metrics import group_size, metrics
+from .protocol import frames
+from .replay import frames_size
+from .timers import wheel
+
+log = get_logger(__name__)
+
+
+def group_name(room):
+    return f'room_{room.id}'
+
+
+async def group_send(room, event):
+    channel_layer = get_channel_layer()
+    if not channel_layer:
+        log.warning('channel_layer_missing', operation='group_send', room_id=room.id)
+        return
+    if metrics.enabled:
+        metrics.broadcasts.inc(event['type'])
+        size = group_size(group_name(room))
+        if size is not None:
+            metrics.fanout.observe(size)
+    await channel_layer.group_send(group_name(room), event)
+
+
+async def broadcast(room, payload, feed=False, key=None, replay=True):
+    """
+    Encode payload once per wire format and send the same frame to every
+    socket in the room. feed frames may be dropped for sockets that fall
+    behind, and a queued feed frame with the same key is replaced (see
+    main.outbox). With replay the payload is numbered and kept in the
+    room's ring (see main.replay).
+    """
+    if replay:
+        seq = room.events.next_seq()
+        payload = dict(payload, seq=seq)
+    event = {
+        'type': 'room_broadcast',
+        'frames': frames(payload, compact=room.compact_sockets > 0)
+    }
+    if feed:
+        event['feed'] = True
+        event['key'] = key
+    if replay:
+        room.events.append(seq, event, frames_size(event['frames']))
+    await group_send(room, event)
+
+
+async def broadcast_roster(room, username, action, version):
+    """Broadcast username's roster change (which produced version) as a full list and as a delta."""
+    full = {
+        'type': 'participants_updated',
+        'participants': room.participants,
+        'room_id': room.id,
+        'action': action,
+        'username': username
+    }
+    delta = {
+        'type': 'participants_updated',
+        'room_id': room.id,
+        'version': version,
+        'added': [username] if action == 'user_joined' else [],
+        'removed': [username] if action == 'user_left' else [],
+        'action': action,
+        'username': username
+    }
+    compact = room.compact_sockets > 0
+    await group_send(room, {
+        'type': 'roster_broadcast',
+        'full': frames(full, compact=compact),
+        'delta': frames(delta, compact=compact)
+    })
+
+
+async def broadcast_game_started(room, time_left=None):
+    """Broadcast game_started, encoded once per role."""
+    seq = room.events.next_seq()
+    guesser = {
+        'type': 'game_started',
+        'current_turn': room.currentTurn,
+        'room_id': room.id,
+        'role': 'guesser',
+        'seq': seq
+    }
+    if room.game is not None:
+        guesser['round'] = room.currentRound
+        guesser['rounds'] = room.rounds
+    if time_left is not None:
+        guesser['time_left'] = time_left
+    actor = dict(guesser, role='actor', emoji=room.currentEmoji)
+    compact = room.compact_sockets > 0
+    event = {
+        'type': 'game_started_broadcast',
+        'current_turn': room.currentTurn,
+        'actor': frames(actor, compact=compact),
+        'guesser': frames(guesser, compact=compact)
+    }
+    room.events.append(seq, event, frames_size(event['actor'], event['guesser']))
+    await group_send(room, event)
+
+
+def batch_window():
+    return getattr(settings, 'GUESS_BATCH_WINDOW', 0.075)
+
+
+async def broadcast_guess(room, payload):
+    """
+    Broadcast a guess_submitted. Right guesses go out at once; wrong ones
+    are held for batch_window() seconds and sent to the room together.
+    """
+    if payload['correct'] or not batch_window():
+        # Anything held back was guessed first
+        await flush_guesses(room)
+        await broadcast(room, payload, feed=not payload['correct'])
+        return
+    room.pending_guesses.append(payload)
+    if room.guess_flush is None:
+        room.guess_flush = wheel.call_later(batch_window(), flush_guesses, room)
+
+
+async def flush_guesses(room):
+    """Send the wrong guesses held for room as one group message."""
+    if room.guess_flush is not None:
+        room.guess_flush.cancel()
+        room.guess_flush = None
+    guesses, room.pending_guesses = room.pending_guesses, []
+    if not guesses:
+        return
+    seq = room.events.next_seq()
+    batch = {
+        'type': 'guesses_batch',
+        'room_id': room.id,
+        'guesses': [[guess['username'], guess['guess']] for guess in guesses],
+        'seq': seq
+    }
+    compact = room.compact_sockets > 0
+    # Sockets that didn't ask for batches get the guesses one by one, as before, all under the batch's seq
+    event = {
+        'type': 'guesses_broadcast',
+        'batch': frames(batch, compact=compact),
+        'single': [frames(dict(guess, seq=seq), compact=compact) for guess in guesses]
+    }
+    room.events.append(seq, event, frames_size(event['batch'], *event['single']))
+    await group_send(room, event)
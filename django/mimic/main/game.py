@@ -0,0 +1,71 @@
+from array import array
+
+# A right guess scores for the guesser and, less, for the actor who got it across
+GUESS_POINTS = 2
+ACTOR_POINTS = 1
+
+
+class Scoreboard:
+    """Scores of one game: a seat per player and an int array indexed by seat."""
+
+    __slots__ = ('seats', 'points')
+
+    def __init__(self, players=()):
+        self.seats = {}
+        self.points = array('l')
+        for username in players:
+            self.seat(username)
+
+    def seat(self, username):
+        index = self.seats.get(username)
+        if index is None:
+            index = self.seats[username] = len(self.points)
+            self.points.append(0)
+        return index
+
+    def award(self, username, points):
+        self.points[self.seat(username)] += points
+
+    def as_dict(self):
+        return {username: self.points[index] for username, index in self.seats.items()}
+
+    def winners(self):
+        if not self.points:
+            return []
+        best = max(self.points)
+        return [username for username, index in self.seats.items() if self.points[index] == best]
+
+
+class Game:
+    """
+    Turn order and scores of the game running in a room.
+
+    Every participant present when a round starts acts once in that round, in
+    join order; players joining mid-round get their turn from the next round.
+    """
+
+    __slots__ = ('order', 'turn', 'scores')
+
+    def __init__(self, players):
+        self.order = list(players)
+        self.turn = 0
+        self.scores = Scoreboard(self.order)
+
+    @property
+    def actor(self):
+        return self.order[self.turn]
+
+    def advance(self, room):
+        """Move to the next actor still in room. Returns 'turn', 'round' or 'finished'."""
+        self.turn += 1
+        while self.turn < len(self.order) and not room.has_participant(self.order[self.turn]):
+            self.turn += 1
+        if self.turn < len(self.order):
+            return 'turn'
+        if room.currentRound >= room.rounds or not room.participants:
+            return 'finished'
+        self.order = list(room.participants)
+        self.turn = 0
+        for username in self.order:
+            self.scores.seat(username)
+        return 'round'
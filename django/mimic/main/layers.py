@@ -0,0 +1,236 @@
+import asyncio
+import collections
+import heapq
+import random
+import string
+import time
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+
+class _Channel:
+    __slots__ = ('messages', 'waiters')
+
+    def __init__(self):
+        # (expires_at, message), oldest first
+        self.messages = collections.deque()
+        self.waiters = collections.deque()
+
+
+class LocalChannelLayer(BaseChannelLayer):
+    """
+    Channel layer for a single process, in place of InMemoryChannelLayer.
+
+    Messages are handed over as they are, not deep-copied: every member of a
+    group receives the same dict, so receivers must not mutate them. A
+    message for a channel that is already waiting resolves the waiter
+    directly, and group_send delivers to every member inline rather than in a
+    task each.
+
+    Nothing is expired on send or receive. A sweep runs every sweep_interval
+    seconds while messages are waiting, otherwise only when the oldest group
+    membership is due, and looks at nothing but channels with undelivered
+    messages and the memberships that have expired.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 sweep_interval=1, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.group_expiry = group_expiry
+        self.sweep_interval = sweep_interval
+        self.channels = {}
+        # group -> {channel: joined_at}, and channel -> groups it is in
+        self.groups = {}
+        self._memberships = {}
+        # Channels holding undelivered messages
+        self._backlog = set()
+        # (expires_at, group, channel, joined_at); stale entries are skipped on the sweep, and
+        # the heap is rebuilt once they outnumber the live memberships
+        self._group_expiry_heap = []
+        self._membership_count = 0
+        self._sweep_handle = None
+        # Group messages lost to full channels
+        self.dropped = 0
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific.'):
+        return '%s.local!%s' % (prefix, ''.join(random.choice(string.ascii_letters) for _ in range(12)))
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        self._deliver(channel, message)
+
+    def _deliver(self, channel, message):
+        state = self.channels.get(channel)
+        if state is None:
+            state = self.channels[channel] = _Channel()
+        while state.waiters:
+            waiter = state.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(message)
+                return
+        if len(state.messages) >= self.get_capacity(channel):
+            raise ChannelFull(channel)
+        state.messages.append((time.monotonic() + self.expiry, message))
+        self._backlog.add(channel)
+        self._schedule_sweep()
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        state = self.channels.get(channel)
+        if state is None:
+            state = self.channels[channel] = _Channel()
+        if state.messages:
+            _, message = state.messages.popleft()
+            self._forget_if_idle(channel, state)
+            return message
+
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a message just as we were cancelled; keep it for the next receive
+                state.messages.appendleft((time.monotonic() + self.expiry, waiter.result()))
+                self._backlog.add(channel)
+                self._schedule_sweep()
+            raise
+        finally:
+            if waiter in state.waiters:
+                state.waiters.remove(waiter)
+            self._forget_if_idle(channel, state)
+
+    def _forget_if_idle(self, channel, state):
+        if not state.messages and not state.waiters and self.channels.get(channel) is state:
+            del self.channels[channel]
+            self._backlog.discard(channel)
+
+    # Expiry
+
+    def _schedule_sweep(self, delay=None):
+        loop = asyncio.get_running_loop()
+        when = loop.time() + (self.sweep_interval if delay is None else delay)
+        if self._sweep_handle is not None:
+            if self._sweep_handle.when() <= when:
+                return
+            self._sweep_handle.cancel()
+        self._sweep_handle = loop.call_at(when, self._sweep)
+
+    def _sweep(self):
+        self._sweep_handle = None
+        now = time.monotonic()
+        for channel in list(self._backlog):
+            state = self.channels.get(channel)
+            if state is None or not state.messages:
+                self._backlog.discard(channel)
+                continue
+            expired = False
+            while state.messages and state.messages[0][0] < now:
+                state.messages.popleft()
+                expired = True
+            if expired:
+                # Nobody is reading this channel any more
+                self._remove_from_groups(channel)
+            if not state.messages:
+                self._backlog.discard(channel)
+                self._forget_if_idle(channel, state)
+
+        heap = self._group_expiry_heap
+        while heap and heap[0][0] < now:
+            _, group, channel, joined_at = heapq.heappop(heap)
+            if self.groups.get(group, {}).get(channel) == joined_at:
+                self._discard(group, channel)
+
+        if self._backlog:
+            self._schedule_sweep()
+        elif heap:
+            # Only memberships left to expire; sleep until the oldest one does
+            self._schedule_sweep(max(self.sweep_interval, heap[0][0] - now))
+
+    def _remove_from_groups(self, channel):
+        for group in list(self._memberships.get(channel, ())):
+            self._discard(group, channel)
+
+    # Flush extension
+
+    async def flush(self):
+        if self._sweep_handle is not None:
+            self._sweep_handle.cancel()
+            self._sweep_handle = None
+        self.channels = {}
+        self.groups = {}
+        self._memberships = {}
+        self._backlog = set()
+        self._group_expiry_heap = []
+        self._membership_count = 0
+
+    async def close(self):
+        pass
+
+    def queue_lengths(self):
+        """Messages waiting per channel."""
+        return {channel: len(state.messages) for channel, state in self.channels.items()}
+
+    def group_size(self, group):
+        return len(self.groups.get(group, ()))
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        joined_at = time.monotonic()
+        members = self.groups.setdefault(group, {})
+        if channel not in members:
+            self._membership_count += 1
+        members[channel] = joined_at
+        self._memberships.setdefault(channel, set()).add(group)
+        heapq.heappush(self._group_expiry_heap, (joined_at + self.group_expiry, group, channel, joined_at))
+        self._compact_group_expiry()
+        self._schedule_sweep(self.group_expiry)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        self._discard(group, channel)
+        self._compact_group_expiry()
+
+    def _compact_group_expiry(self):
+        """Rebuild the expiry heap from the live memberships once it is mostly stale entries."""
+        if len(self._group_expiry_heap) <= 2 * self._membership_count:
+            return
+        heap = [
+            (joined_at + self.group_expiry, group, channel, joined_at)
+            for group, members in self.groups.items()
+            for channel, joined_at in members.items()
+        ]
+        heapq.heapify(heap)
+        self._group_expiry_heap = heap
+
+    def _discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            if members.pop(channel, None) is not None:
+                self._membership_count -= 1
+            if not members:
+                del self.groups[group]
+        groups = self._memberships.get(channel)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                del self._memberships[channel]
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+        for channel in list(self.groups.get(group, ())):
+            try:
+                self._deliver(channel, message)
+            except ChannelFull:
+                self.dropped += 1
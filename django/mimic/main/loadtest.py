@@ -0,0 +1,353 @@
+"""
+Load generator for the /ws/room/ protocol, used by `manage.py loadtest`.
+
+Every room gets a host that creates it and players that join it; the host
+starts the game and then everyone submits guesses until the run is over.
+The time from sending a message to its reply is recorded per message type,
+and the run is summed up as one JSON-serializable report.
+
+Clients talk either straight to an ASGI application in this process
+(AsgiTransport) or over TCP to a running Daphne (TcpTransport).
+"""
+import asyncio
+import base64
+import collections
+import json
+import os
+import random
+import struct
+import subprocess
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from asgiref.testing import ApplicationCommunicator
+
+from .emojis import catalog
+from .protocol import COMPACT_SUBPROTOCOL, decode
+
+
+class AsgiTransport:
+    """A websocket to an ASGI application running in this event loop."""
+
+    def __init__(self, application, path='/ws/room/', compact=False):
+        self.application = application
+        self.path = path
+        self.compact = compact
+        self.communicator = None
+
+    async def connect(self, timeout):
+        self.communicator = ApplicationCommunicator(self.application, {
+            'type': 'websocket',
+            'path': self.path,
+            'query_string': b'',
+            'headers': [(b'host', b'localhost'), (b'origin', b'http://localhost')],
+            'subprotocols': [COMPACT_SUBPROTOCOL] if self.compact else [],
+        })
+        await self.communicator.send_input({'type': 'websocket.connect'})
+        message = await self.communicator.receive_output(timeout)
+        if message['type'] != 'websocket.accept':
+            raise ConnectionError(f'Connection refused: {message}')
+
+    async def send(self, text):
+        await self.communicator.send_input({'type': 'websocket.receive', 'text': text})
+
+    async def receive(self):
+        """The next frame as (text, bytes), or None once the socket is closed."""
+        # Read the queue directly: receive_output() cancels the application when it times out
+        message = await self.communicator.output_queue.get()
+        if message['type'] != 'websocket.send':
+            return None
+        return message.get('text'), message.get('bytes')
+
+    async def close(self):
+        await self.communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        try:
+            await self.communicator.wait(timeout=1)
+        except asyncio.TimeoutError:
+            pass
+
+
+class TcpTransport:
+    """A minimal RFC 6455 client, enough to drive a local Daphne."""
+
+    def __init__(self, url, compact=False):
+        parts = urlsplit(url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 80
+        self.path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        self.compact = compact
+        self.reader = self.writer = None
+
+    async def connect(self, timeout):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout)
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = [
+            f'GET {self.path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            f'Origin: http://{self.host}:{self.port}',
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            f'Sec-WebSocket-Key: {key}',
+            'Sec-WebSocket-Version: 13',
+        ]
+        if self.compact:
+            request.append(f'Sec-WebSocket-Protocol: {COMPACT_SUBPROTOCOL}')
+        self.writer.write(('\r\n'.join(request) + '\r\n\r\n').encode())
+        head = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), timeout)
+        if b' 101 ' not in head.split(b'\r\n', 1)[0]:
+            raise ConnectionError(f'Handshake refused: {head.splitlines()[0]!r}')
+
+    def _write_frame(self, opcode, payload):
+        mask = os.urandom(4)
+        n = len(payload)
+        if n < 126:
+            header = struct.pack('>BB', 0x80 | opcode, 0x80 | n)
+        elif n <= 0xffff:
+            header = struct.pack('>BBH', 0x80 | opcode, 0x80 | 126, n)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 0x80 | 127, n)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.writer.write(header + mask + masked)
+
+    async def send(self, text):
+        self._write_frame(0x1, text.encode())
+        await self.writer.drain()
+
+    async def _read_frame(self):
+        first, second = await self.reader.readexactly(2)
+        n = second & 0x7f
+        if n == 126:
+            n = struct.unpack('>H', await self.reader.readexactly(2))[0]
+        elif n == 127:
+            n = struct.unpack('>Q', await self.reader.readexactly(8))[0]
+        mask = await self.reader.readexactly(4) if second & 0x80 else None
+        payload = await self.reader.readexactly(n)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return bool(first & 0x80), first & 0x0f, payload
+
+    async def receive(self):
+        opcode = None
+        data = b''
+        try:
+            while True:
+                fin, frame_opcode, payload = await self._read_frame()
+                if frame_opcode == 0x8:
+                    return None
+                if frame_opcode == 0x9:
+                    self._write_frame(0xa, payload)
+                    continue
+                if frame_opcode == 0xa:
+                    continue
+                if frame_opcode:
+                    opcode = frame_opcode
+                data += payload
+                if fin:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        if opcode == 0x1:
+            return data.decode(), None
+        return None, data
+
+    async def close(self):
+        try:
+            self._write_frame(0x8, struct.pack('>H', 1000))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.timeouts = collections.Counter()
+        self.errors = 0
+        self.sent = 0
+        self.received = 0
+
+
+class LoadClient:
+    """One simulated player: a transport plus a reader that hands replies to whoever waits for them."""
+
+    def __init__(self, transport, username, stats):
+        self.transport = transport
+        self.username = username
+        self.stats = stats
+        self.waiters = collections.defaultdict(collections.deque)
+        self.reader = None
+
+    async def connect(self, timeout):
+        await self.transport.connect(timeout)
+        self.reader = asyncio.ensure_future(self._read())
+        await self.send({'type': 'user', 'username': self.username})
+
+    async def _read(self):
+        while True:
+            frame = await self.transport.receive()
+            if frame is None:
+                break
+            self.stats.received += 1
+            message = decode(*frame)
+            waiters = self.waiters.get(message.get('type'))
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(message)
+                    break
+        for waiters in self.waiters.values():
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(ConnectionError('Socket closed'))
+
+    async def send(self, payload):
+        self.stats.sent += 1
+        await self.transport.send(json.dumps(payload))
+
+    async def request(self, payload, replies, timeout):
+        """Send payload and wait for the first message of a type in replies; records the round trip."""
+        future = asyncio.get_running_loop().create_future()
+        for reply in replies:
+            self.waiters[reply].append(future)
+        start = time.perf_counter()
+        await self.send(payload)
+        try:
+            message = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts[payload['type']] += 1
+            return None
+        finally:
+            for reply in replies:
+                if future in self.waiters[reply]:
+                    self.waiters[reply].remove(future)
+        self.stats.latencies[payload['type']].append(time.perf_counter() - start)
+        return message
+
+    async def close(self):
+        await self.transport.close()
+        if self.reader is not None:
+            self.reader.cancel()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def rss_bytes(pid='self'):
+    """Resident memory of a process from /proc, or None where that isn't available."""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def setup_room(index, make_transport, players, stats, timeout):
+    """Connect players into one room. Returns its clients, host first, or None if the room couldn't be set up."""
+    clients = [LoadClient(make_transport(), f'load{index}_{n}', stats) for n in range(players)]
+    try:
+        for client in clients:
+            await client.connect(timeout)
+        created = await clients[0].request({'type': 'create_room'}, ('room_created',), timeout)
+        if created is None:
+            raise ConnectionError('Room was not created')
+        for client in clients[1:]:
+            await client.request({'type': 'join_room', 'room_id': created['room_id']}, ('joined_room', 'error'), timeout)
+    except (ConnectionError, OSError, asyncio.TimeoutError):
+        stats.errors += 1
+        await asyncio.gather(*(client.close() for client in clients if client.reader), return_exceptions=True)
+        return None
+    return clients
+
+
+async def play_room(clients, deadline, guess_interval, timeout):
+    await clients[0].request({'type': 'start_game'}, ('game_started',), timeout)
+
+    async def guess(client):
+        # Spread the first guesses out so a room's players don't move in lockstep
+        await asyncio.sleep(random.uniform(0, guess_interval))
+        while time.perf_counter() < deadline:
+            await client.request({'type': 'submit_guess', 'guess': catalog.random()},
+                                 ('guess_result', 'rate_limited'), timeout)
+            await asyncio.sleep(guess_interval)
+
+    await asyncio.gather(*(guess(client) for client in clients))
+
+
+async def run_load(make_transport, rooms=10, players=5, duration=10, guess_interval=0.5,
+                   timeout=5, server_pid=None, target='asgi', compact=False):
+    """Run the scenario and return the report."""
+    started_at = datetime.now(timezone.utc).isoformat()
+    stats = Stats()
+    memory_pid = server_pid or ('self' if target == 'asgi' else None)
+
+    memory_before = rss_bytes(memory_pid) if memory_pid else None
+    setup_start = time.perf_counter()
+    rooms_clients = [
+        clients for clients in await asyncio.gather(*(
+            setup_room(index, make_transport, players, stats, timeout) for index in range(rooms)
+        )) if clients
+    ]
+    setup_seconds = time.perf_counter() - setup_start
+    connections = sum(len(clients) for clients in rooms_clients)
+    memory_after = rss_bytes(memory_pid) if memory_pid else None
+
+    sent_before, received_before = stats.sent, stats.received
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        play_room(clients, start + duration, guess_interval, timeout) for clients in rooms_clients
+    ))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*(client.close() for clients in rooms_clients for client in clients),
+                         return_exceptions=True)
+
+    memory_per_connection = None
+    if memory_before is not None and memory_after is not None and connections:
+        memory_per_connection = round((memory_after - memory_before) / connections)
+    return {
+        'started_at': started_at,
+        'commit': git_commit(),
+        'target': target,
+        'config': {
+            'rooms': rooms,
+            'players': players,
+            'duration': duration,
+            'guess_interval': guess_interval,
+            'timeout': timeout,
+            'compact': compact,
+        },
+        'connections': connections,
+        'setup_seconds': round(setup_seconds, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'messages_sent': stats.sent - sent_before,
+        'messages_received': stats.received - received_before,
+        'sent_per_second': round((stats.sent - sent_before) / elapsed, 1),
+        'received_per_second': round((stats.received - received_before) / elapsed, 1),
+        'latency_ms': {
+            kind: {
+                'count': len(values),
+                'p50': round(percentile(values, 0.5) * 1000, 3),
+                'p99': round(percentile(values, 0.99) * 1000, 3),
+                'max': round(max(values) * 1000, 3),
+            }
+            for kind, values in sorted(stats.latencies.items())
+        },
+        'timeouts': dict(stats.timeouts),
+        'errors': stats.errors,
+        # In-process runs count the simulated clients too, so this is an upper bound
+        'memory_per_connection_bytes': memory_per_connection,
+    }
@@ -0,0 +1,120 @@
+"""
+Structured, sampled logging that never blocks the event loop.
+
+Code logs named events with fields:
+
+    log = get_logger(__name__)
+    log.warning('channel_layer_missing', operation='group_add')
+
+Events below the logger's level, or not picked by their sample rate in
+settings.LOG_SAMPLING, cost one check and build no record. Records that are
+kept are put on a queue by QueueingHandler and formatted and written by a
+listener thread, so the loop never waits on stdout. Levels and handlers are
+set in settings.LOGGING.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+from django.conf import settings
+
+_sample_rates = None
+
+
+def sample_rates():
+    global _sample_rates
+    if _sample_rates is None:
+        _sample_rates = dict(getattr(settings, 'LOG_SAMPLING', {}))
+    return _sample_rates
+
+
+def sampled(event):
+    rate = sample_rates().get(event, 1)
+    return rate >= 1 or random.random() < rate
+
+
+class EventLogger:
+    """A logging.Logger that takes an event name and fields instead of a message."""
+
+    __slots__ = ('logger',)
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def event(self, level, event, exc_info=None, **fields):
+        if not self.logger.isEnabledFor(level) or not sampled(event):
+            return
+        self.logger.log(level, event, exc_info=exc_info, extra={'event': event, 'fields': fields})
+
+    def debug(self, event, **fields):
+        self.event(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.event(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.event(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.event(logging.ERROR, event, **fields)
+
+
+def get_logger(name):
+    return EventLogger(logging.getLogger(name))
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, event and the event's fields."""
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': getattr(record, 'event', None) or record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=repr, ensure_ascii=False)
+
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a listener thread that writes them to stream.
+
+    Records are queued as they are, not pre-formatted, so formatting happens
+    on the listener thread too. When the queue is full records are dropped
+    rather than waited on.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
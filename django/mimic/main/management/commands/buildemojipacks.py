@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.packs import build_index, index_path, source_path
+
+
+class Command(BaseCommand):
+    help = 'Compile the Unicode emoji data into the index the emoji packs are loaded from.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help='Where to write the index (default EMOJI_PACK_INDEX).')
+
+    def handle(self, *args, **options):
+        source = source_path()
+        if source is None:
+            raise CommandError('random_unicode_emoji is not installed')
+        path = options['output'] or index_path()
+        count = build_index(source, path)
+        self.stdout.write(f'Indexed {count} emoji(s) into {path}')
@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main.loadtest import AsgiTransport, TcpTransport, run_load
+
+
+class Command(BaseCommand):
+    help = 'Simulate rooms of players against the room protocol and report latency and throughput as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=None,
+                            help='Websocket URL of a running server, e.g. ws://127.0.0.1:8000/ws/room/. '
+                                 'Without it the ASGI application is driven in this process against a test database.')
+        parser.add_argument('--rooms', type=int, default=10, help='Rooms to create (default 10).')
+        parser.add_argument('--players', type=int, default=5, help='Players per room, host included (default 5).')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of guessing (default 10).')
+        parser.add_argument('--guess-interval', type=float, default=0.5,
+                            help='Seconds each player waits between guesses (default 0.5).')
+        parser.add_argument('--timeout', type=float, default=5, help='Seconds to wait for a reply (default 5).')
+        parser.add_argument('--compact', action='store_true', help='Negotiate the compact binary protocol.')
+        parser.add_argument('--no-rate-limit', action='store_true',
+                            help='Turn GUESS_RATE_LIMIT off for an in-process run.')
+        parser.add_argument('--server-pid', type=int, default=None,
+                            help='Pid of the server behind --url, to report its memory per connection.')
+        parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['players'] < 1 or options['rooms'] < 1:
+            raise CommandError('--rooms and --players must be at least 1')
+        compact = options['compact']
+        config = dict(
+            rooms=options['rooms'],
+            players=options['players'],
+            duration=options['duration'],
+            guess_interval=options['guess_interval'],
+            timeout=options['timeout'],
+            compact=compact,
+        )
+
+        if options['url']:
+            report = asyncio.run(run_load(
+                lambda: TcpTransport(options['url'], compact),
+                server_pid=options['server_pid'], target=options['url'], **config))
+        else:
+            from mimic.asgi import application
+
+            if options['no_rate_limit']:
+                settings.GUESS_RATE_LIMIT = {'socket_rate': 0, 'room_rate': 0}
+            # Rooms created by the run never touch the real database
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                report = asyncio.run(run_load(lambda: AsgiTransport(application, compact=compact), **config))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(output)
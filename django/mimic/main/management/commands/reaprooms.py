@@ -0,0 +1,31 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from main.reaper import reap_rooms, reaper_settings, run_reaper
+
+
+class Command(BaseCommand):
+    help = 'Delete empty, finished and stale rooms.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--daemon', action='store_true',
+                            help='Keep running, reaping every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Seconds between runs in daemon mode (default ROOM_REAPER["interval"]).')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rooms deleted per transaction (default ROOM_REAPER["batch_size"]).')
+
+    def report(self, reclaimed):
+        self.stdout.write(f'Reclaimed {reclaimed} room(s)')
+
+    def handle(self, *args, **options):
+        if options['daemon']:
+            interval = options['interval'] or reaper_settings()['interval']
+            self.stdout.write(f'Reaping rooms every {interval:g}s')
+            try:
+                asyncio.run(run_reaper(interval, report=self.report, batch_size=options['batch_size']))
+            except KeyboardInterrupt:
+                pass
+        else:
+            self.report(asyncio.run(reap_rooms(options['batch_size'])))
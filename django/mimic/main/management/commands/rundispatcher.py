@@ -0,0 +1,25 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.dispatcher import serve
+
+
+class Command(BaseCommand):
+    help = 'Route sockets to the ROOM_WORKERS process that owns their room.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('addrport', nargs='?', default='0.0.0.0:8000',
+                            help='Address and port to listen on (default 0.0.0.0:8000).')
+
+    def handle(self, *args, **options):
+        if not settings.ROOM_WORKERS:
+            raise CommandError('Set ROOM_WORKERS to the Daphne workers to dispatch to.')
+        host, _, port = options['addrport'].rpartition(':')
+        host = host or '0.0.0.0'
+        self.stdout.write(f"Dispatching {host}:{port} to {', '.join(settings.ROOM_WORKERS)}")
+        try:
+            asyncio.run(serve(settings.ROOM_WORKERS, host, int(port)))
+        except KeyboardInterrupt:
+            pass
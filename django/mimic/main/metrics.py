@@ -0,0 +1,201 @@
+"""
+In-process metrics, exported in the Prometheus text format at /metrics.
+
+Instrumented code checks metrics.enabled before doing any work, so with
+settings.METRICS_ENABLED off the cost is one attribute read per call site.
+Gauges of live state (rooms, rounds, channel layer queues) are read only
+when /metrics is scraped.
+"""
+import bisect
+import time
+
+from channels.layers import get_channel_layer
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+FANOUT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _labels(label, value):
+    return f'{{{label}="{value}"}}' if label else ''
+
+
+class Counter:
+    """Counts per label value, or a count read from read() at scrape time."""
+
+    __slots__ = ('name', 'help', 'label', 'values', 'read')
+
+    def __init__(self, name, help, label=None, read=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        self.read = read
+
+    def inc(self, value='', amount=1):
+        self.values[value] = self.values.get(value, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        if self.read is not None:
+            yield f'{self.name} {self.read()}'
+            return
+        for value, count in sorted(self.values.items()):
+            yield f'{self.name}{_labels(self.label, value)} {count}'
+
+
+class Gauge:
+    """A value set by the code, or read from read() at scrape time."""
+
+    __slots__ = ('name', 'help', 'value', 'read')
+
+    def __init__(self, name, help, read=None):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.read = read
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} gauge'
+        yield f'{self.name} {self.read() if self.read else self.value}'
+
+
+class Histogram:
+    """Fixed buckets per label value; observe() is one bisect and three additions."""
+
+    __slots__ = ('name', 'help', 'label', 'buckets', 'series')
+
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # label value -> [per-bucket counts (+Inf last), sum, count]
+        self.series = {}
+
+    def observe(self, amount, value=''):
+        series = self.series.get(value)
+        if series is None:
+            series = self.series[value] = [[0] * (len(self.buckets) + 1), 0, 0]
+        series[0][bisect.bisect_left(self.buckets, amount)] += 1
+        series[1] += amount
+        series[2] += 1
+
+    def observe_since(self, start, value=''):
+        self.observe(time.perf_counter() - start, value)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for value, (counts, total, count) in sorted(self.series.items()):
+            label = f'{self.label}="{value}",' if self.label else ''
+            cumulative = 0
+            for bound, bucket in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket
+                yield f'{self.name}_bucket{{{label}le="{bound}"}} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.label, value)} {total}'
+            yield f'{self.name}_count{_labels(self.label, value)} {count}'
+
+
+class RoomCounter:
+    """A count kept on each live RoomState, read per room at scrape time."""
+
+    __slots__ = ('name', 'help', 'field')
+
+    def __init__(self, name, help, field):
+        self.name = name
+        self.help = help
+        self.field = field
+
+    def render(self):
+        from .rooms import registry
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for room_id, room in sorted(registry.rooms.items()):
+            count = getattr(room, self.field)
+            if count:
+                yield f'{self.name}{_labels("room", room_id)} {count}'
+
+
+def _live_rooms():
+    from .rooms import registry
+    return len(registry.rooms)
+
+
+def _running_rounds():
+    from .rounds import clock
+    return len(clock.rounds)
+
+
+def _layer_queue_lengths():
+    """Messages waiting per channel in this process's channel layer."""
+    layer = get_channel_layer()
+    if layer is None:
+        return {}
+    if hasattr(layer, 'queue_lengths'):
+        return layer.queue_lengths()
+    # channels.layers.InMemoryChannelLayer
+    return {channel: queue.qsize() for channel, queue in getattr(layer, 'channels', {}).items()}
+
+
+def _layer_dropped():
+    return getattr(get_channel_layer(), 'dropped', 0)
+
+
+def group_size(group):
+    """Sockets in group as far as this process can tell without a round trip, or None."""
+    layer = get_channel_layer()
+    if layer is None:
+        return None
+    if hasattr(layer, 'group_size'):
+        return layer.group_size(group)
+    groups = getattr(layer, 'groups', None)
+    return None if groups is None else len(groups.get(group, ()))
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.messages = Histogram('mimic_message_seconds', 'Time to handle a websocket message.', 'type')
+        self.broadcasts = Counter('mimic_broadcasts_total', 'Group messages sent, by event type.', 'event')
+        self.fanout = Histogram('mimic_broadcast_fanout', 'Sockets a group message was sent to.', buckets=FANOUT_BUCKETS)
+        self.db = Histogram('mimic_db_seconds', 'Time spent in database calls.', 'operation')
+        self.sockets = Gauge('mimic_sockets', 'Open websockets.')
+        self.rooms = Gauge('mimic_rooms', 'Rooms live in this worker.', _live_rooms)
+        self.rounds = Gauge('mimic_running_rounds', 'Rooms with a turn clock running.', _running_rounds)
+        self.layer_queued = Gauge(
+            'mimic_layer_queued_messages', 'Messages waiting in channel layer queues.',
+            lambda: sum(_layer_queue_lengths().values()))
+        self.layer_queue_max = Gauge(
+            'mimic_layer_queue_max', 'Longest channel layer queue.',
+            lambda: max(_layer_queue_lengths().values(), default=0))
+        self.layer_dropped = Counter(
+            'mimic_layer_dropped_total', 'Group messages dropped because a channel was full.',
+            read=_layer_dropped)
+        self.outbox_dropped = Counter('mimic_outbox_dropped_total', 'Feed frames dropped for slow sockets.')
+        self.evictions = Counter('mimic_slow_socket_evictions_total', 'Sockets closed for not keeping up.')
+        self.room_dropped = RoomCounter(
+            'mimic_room_dropped_frames_total', 'Feed frames dropped for slow sockets, per live room.',
+            'dropped_frames')
+        self.room_evictions = RoomCounter(
+            'mimic_room_slow_socket_evictions_total', 'Sockets closed for not keeping up, per live room.',
+            'evicted_sockets')
+
+    def instruments(self):
+        return (self.messages, self.broadcasts, self.fanout, self.db, self.sockets,
+                self.rooms, self.rounds, self.layer_queued, self.layer_queue_max,
+                self.layer_dropped, self.outbox_dropped, self.evictions, self.room_dropped,
+                self.room_evictions)
+
+    def render(self):
+        return '\n'.join(line for instrument in self.instruments() for line in instrument.render()) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_participants(apps, schema_editor):
+    Room = apps.get_model('main', 'Room')
+    Participant = apps.get_model('main', 'Participant')
+    batch = []
+    for room_id, usernames in Room.objects.values_list('id', 'participants').iterator():
+        for username in dict.fromkeys(usernames or []):
+            batch.append(Participant(room_id=room_id, username=username))
+        if len(batch) >= 1000:
+            Participant.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    Participant.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def restore_participants(apps, schema_editor):
+    Room = apps.get_model('main', 'Room')
+    Participant = apps.get_model('main', 'Participant')
+    rosters = {}
+    for room_id, username in Participant.objects.order_by('joined_at', 'id').values_list('room_id', 'username'):
+        rosters.setdefault(room_id, []).append(username)
+    for room_id, usernames in rosters.items():
+        Room.objects.filter(id=room_id).update(participants=usernames)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_room_currentemoji_room_currentturn_room_gamestate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Participant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(db_index=True, max_length=100)),
+                ('joined_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='main.room')),
+            ],
+            options={
+                'verbose_name': 'Participant',
+                'verbose_name_plural': 'Participants',
+                'constraints': [models.UniqueConstraint(fields=('room', 'username'), name='unique_room_participant')],
+            },
+        ),
+        migrations.RunPython(copy_participants, restore_participants),
+        migrations.RemoveField(
+            model_name='room',
+            name='participants',
+        ),
+    ]
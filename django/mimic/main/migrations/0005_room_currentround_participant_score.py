@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_participant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='currentRound',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_room_currentround_participant_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='deckState',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
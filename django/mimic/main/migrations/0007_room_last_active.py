@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:45
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_last_active(apps, schema_editor):
+    # Nothing is known about existing rooms beyond when they were made
+    Room = apps.get_model('main', 'Room')
+    Room.objects.update(last_active=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_room_deckstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_active',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_last_active, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,70 @@
 from django.db import models
+from django.utils import timezone
+import random
 import string
-import secrets
+import threading
+import time
+
+
+class RoomIdAllocator:
+    """
+    Hands out unique, time-ordered 9-letter room ids without asking the database.
+
+    An id is 6 letters of seconds since ROOM_ID_EPOCH, 1 letter of node (one
+    per process) and 2 letters of sequence within that second. Ids from one
+    node never repeat; when a second's 676 sequence numbers run out the
+    allocator borrows the next second. New rows land at the right-hand end
+    of the primary key index instead of at random pages.
+
+    The sequence goes through a per-process shuffle so consecutive rooms
+    don't get guessable neighbouring codes.
+    """
+
+    alphabet = string.ascii_uppercase
+    epoch = 1735689600  # 2025-01-01 UTC
+    time_letters = 6
+    sequence_letters = 2
+
+    def __init__(self, node=None):
+        base = len(self.alphabet)
+        self.node = random.randrange(base) if node is None else node % base
+        self.sequence_size = base ** self.sequence_letters
+        self.time_size = base ** self.time_letters
+        self._sequence_order = random.sample(range(self.sequence_size), self.sequence_size)
+        self._lock = threading.Lock()
+        self._second = -1
+        self._sequence = 0
+
+    def _encode(self, value, letters):
+        base = len(self.alphabet)
+        out = []
+        for _ in range(letters):
+            value, digit = divmod(value, base)
+            out.append(self.alphabet[digit])
+        return ''.join(reversed(out))
+
+    def next_id(self):
+        with self._lock:
+            second = int(time.time()) - self.epoch
+            if second > self._second:
+                self._second, self._sequence = second, 0
+            elif self._sequence >= self.sequence_size:
+                self._second, self._sequence = self._second + 1, 0
+            sequence = self._sequence_order[self._sequence]
+            self._sequence += 1
+            return (
+                self._encode(self._second % self.time_size, self.time_letters)
+                + self.alphabet[self.node]
+                + self._encode(sequence, self.sequence_letters)
+            )
+
+
+room_ids = RoomIdAllocator()
 
 
 def generate_room_id():
     """Generate a unique 9-character room ID using uppercase letters."""
-    alphabet = string.ascii_uppercase
-    return ''.join(secrets.choice(alphabet) for _ in range(9))
+    return room_ids.next_id()
 
 
 # Create your models here.
@@ -14,13 +72,17 @@ class Room(models.Model):
     id = models.CharField(max_length=9, primary_key=True, default=generate_room_id, unique=True)
     rounds = models.IntegerField(default=3)
     timer = models.IntegerField(default=90)
-    participants = models.JSONField(default=list) 
     currentTurn = models.CharField(max_length=100, null=True, blank=True)
     currentEmoji = models.CharField(max_length=100, null=True, blank=True)
     gameState = models.CharField(max_length=20, default='waiting')  # 'waiting', 'in_progress', 'finished'
+    currentRound = models.IntegerField(default=0)
+    # main.decks.Deck.dumps() of the deck the room's emojis are dealt from
+    deckState = models.CharField(max_length=64, blank=True, default='')
 
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped by every write of the room's live state; the reaper expires rooms by it
+    last_active = models.DateTimeField(default=timezone.now, db_index=True)
 
 
 
@@ -31,4 +93,20 @@ class Room(models.Model):
         verbose_name = "Room"
         verbose_name_plural = "Rooms"
 
-    
\ No newline at end of file
+
+class Participant(models.Model):
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='members')
+    username = models.CharField(max_length=100, db_index=True)
+    joined_at = models.DateTimeField(auto_now_add=True)
+    # Written at round boundaries, not per guess
+    score = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.username} in room {self.room_id}"
+
+    class Meta:
+        verbose_name = "Participant"
+        verbose_name_plural = "Participants"
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'username'], name='unique_room_participant'),
+        ]
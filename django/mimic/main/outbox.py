@@ -0,0 +1,181 @@
+"""
+Per-socket outbound queues, so one slow client can't hold up its room.
+
+Group handlers and replies put frames on the socket's Outbox and return at
+once; a writer task, alive only while there is something to send, writes
+them out in order. Frames are either state (replies, game_started,
+turn_ended, game_over, roster changes), which is always delivered, or feed
+(wrong guesses, guesses_batch, time_left), which a socket that falls behind
+can do without: the oldest feed frames are dropped past feed_limit, and a
+feed frame with a key replaces the queued frame with the same key. A socket
+whose queue hasn't emptied for slow_after seconds, or holds more than
+state_limit frames, is closed with SLOW_CLOSE_CODE.
+
+A socket only falls behind if send() tells us so. Servers whose send waits
+for the peer (uvicorn, websockets) do that themselves. Daphne's doesn't: it
+hands each frame to Twisted, which buffers whatever the peer hasn't read.
+For Daphne over plain TCP, server_buffer() reads that buffer's size, and
+the writer holds frames here while it is over buffer_limit bytes. Servers
+that neither wait nor expose their buffer (Daphne behind TLS, for one)
+never look slow, so their unread frames are bounded only by the server.
+"""
+import asyncio
+import collections
+import functools
+import time
+
+from django.conf import settings
+
+from .log import get_logger
+
+log = get_logger(__name__)
+
+SLOW_CLOSE_CODE = 4008
+
+DEFAULTS = {
+    'feed_limit': 64,
+    'state_limit': 1000,
+    'slow_after': 10,
+    'buffer_limit': 64 * 1024,
+}
+
+# Seconds between looks at a full server buffer
+DRAIN_POLL = 0.05
+
+
+def outbox_settings():
+    return {**DEFAULTS, **getattr(settings, 'SOCKET_OUTBOX', {})}
+
+
+def server_buffer(send):
+    """
+    A callable giving the bytes the server still holds for the socket behind
+    an ASGI send, or None when the server doesn't let us see that. Only
+    Daphne over plain TCP does: its send is partial(handle_reply, protocol),
+    and the protocol's Twisted transport keeps unwritten data in dataBuffer
+    and _tempDataBuffer.
+    """
+    if not isinstance(send, functools.partial) or not send.args:
+        return None
+    transport = getattr(send.args[0], 'transport', None)
+    if transport is None or not hasattr(transport, '_tempDataLen') or not hasattr(transport, 'offset'):
+        return None
+    return lambda: len(transport.dataBuffer) - transport.offset + transport._tempDataLen
+
+
+class Outbox:
+    """Frames waiting for one socket, as [send kwargs, feed, key] entries."""
+
+    __slots__ = ('send', 'on_drop', 'on_slow', 'buffered', 'feed_limit', 'state_limit', 'slow_after',
+                 'buffer_limit', 'entries', 'keyed', 'feed', 'backlog_since', 'writer', 'closed')
+
+    def __init__(self, send, on_drop=None, on_slow=None, buffered=None, feed_limit=DEFAULTS['feed_limit'],
+                 state_limit=DEFAULTS['state_limit'], slow_after=DEFAULTS['slow_after'],
+                 buffer_limit=DEFAULTS['buffer_limit']):
+        self.send = send
+        self.on_drop = on_drop
+        self.on_slow = on_slow
+        # See server_buffer()
+        self.buffered = buffered
+        self.feed_limit = feed_limit
+        self.state_limit = state_limit
+        self.slow_after = slow_after
+        self.buffer_limit = buffer_limit
+        self.entries = collections.deque()
+        # key -> its queued entry
+        self.keyed = {}
+        self.feed = 0
+        # When the writer last started on a queue; it stops once the queue is empty
+        self.backlog_since = None
+        self.writer = None
+        self.closed = False
+
+    @classmethod
+    def from_settings(cls, send, on_drop=None, on_slow=None, buffered=None):
+        return cls(send, on_drop, on_slow, buffered, **outbox_settings())
+
+    def put(self, frame, feed=False, key=None):
+        """Queue frame, the keyword arguments of one send()."""
+        if self.closed:
+            return
+        if key is not None:
+            entry = self.keyed.get(key)
+            if entry is not None:
+                entry[0] = frame
+                return
+        if self.writer is None:
+            self.backlog_since = time.monotonic()
+        elif self.slow_after and time.monotonic() - self.backlog_since > self.slow_after:
+            self._evict()
+            return
+
+        entry = [frame, feed, key]
+        self.entries.append(entry)
+        if key is not None:
+            self.keyed[key] = entry
+        if feed:
+            self.feed += 1
+            if self.feed > self.feed_limit:
+                self._drop_oldest_feed()
+        elif len(self.entries) - self.feed > self.state_limit:
+            self._evict()
+            return
+
+        if self.writer is None:
+            self.writer = asyncio.ensure_future(self._write())
+
+    def _drop_oldest_feed(self):
+        for index, entry in enumerate(self.entries):
+            if entry[1]:
+                del self.entries[index]
+                self._forget(entry)
+                break
+        if self.on_drop is not None:
+            self.on_drop()
+
+    def _forget(self, entry):
+        if entry[1]:
+            self.feed -= 1
+        if entry[2] is not None and self.keyed.get(entry[2]) is entry:
+            del self.keyed[entry[2]]
+
+    def _evict(self):
+        queued = len(self.entries)
+        self.close()
+        if self.on_slow is not None:
+            self.on_slow(queued)
+
+    async def _write(self):
+        try:
+            while self.entries:
+                while self.buffered is not None and self.buffered() > self.buffer_limit:
+                    # The peer isn't reading; keep frames here, where feed can be dropped
+                    if self.slow_after and time.monotonic() - self.backlog_since > self.slow_after:
+                        self._evict()
+                        return
+                    await asyncio.sleep(DRAIN_POLL)
+                entry = self.entries.popleft()
+                self._forget(entry)
+                await self.send(**entry[0])
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            # The socket went away underneath us; nothing queued can reach it now
+            log.warning('outbox_send_failed', error=repr(exc))
+            self.entries.clear()
+            self.keyed.clear()
+            self.feed = 0
+        finally:
+            self.writer = None
+            self.backlog_since = None
+
+    def close(self):
+        """Drop everything queued and stop writing."""
+        self.closed = True
+        self.entries.clear()
+        self.keyed.clear()
+        self.feed = 0
+        if self.writer is not None:
+            if self.writer is not asyncio.current_task():
+                self.writer.cancel()
+            self.writer = None
@@ -0,0 +1,195 @@
+"""
+Emoji packs hosts can choose per room.
+
+'charades' is the hand-picked catalog in main.emojis. The other packs come
+from the Unicode emoji-test.txt bundled with random_unicode_emoji, compiled
+into an index file (settings.EMOJI_PACK_INDEX) by `manage.py buildemojipacks`
+as a deploy step: a JSON table of contents on the first line, then the emojis
+of every subgroup as space-separated UTF-8. Workers never build the index;
+without one only 'charades' is offered. They map the file and only decode the
+subgroups of packs some room actually uses, on first use; the resulting
+catalog is then shared by every room of the worker.
+"""
+import json
+import mmap
+import os
+import threading
+
+from django.conf import settings
+
+from .emojis import EmojiCatalog, catalog
+from .log import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_PACK = 'charades'
+
+# Packs built from the Unicode data, and the emoji-test.txt groups they take
+UNICODE_PACKS = {
+    'unicode': ('Smileys & Emotion', 'People & Body', 'Animals & Nature', 'Food & Drink',
+                'Travel & Places', 'Activities', 'Objects', 'Symbols', 'Flags'),
+    'smileys': ('Smileys & Emotion',),
+    'people': ('People & Body',),
+    'nature': ('Animals & Nature',),
+    'food': ('Food & Drink',),
+    'travel': ('Travel & Places',),
+    'activities': ('Activities',),
+    'objects': ('Objects',),
+    'symbols': ('Symbols',),
+    'flags': ('Flags',),
+}
+
+INDEX_FORMAT = 1
+
+# Skin tone variants are the same emoji to the catalog; leaving them out keeps the index small
+_SKIN_TONES = {chr(c) for c in range(0x1F3FB, 0x1F400)}
+
+
+def source_path():
+    """emoji-test.txt of the installed random_unicode_emoji, or None when it isn't installed."""
+    try:
+        import random_unicode_emoji
+    except ImportError:
+        return None
+    path = os.path.join(os.path.dirname(random_unicode_emoji.__file__), 'emoji', 'latest', 'emoji-test.txt')
+    return path if os.path.exists(path) else None
+
+
+def index_path():
+    return str(getattr(settings, 'EMOJI_PACK_INDEX', None) or os.path.join(settings.BASE_DIR, 'emoji_packs.idx'))
+
+
+def parse_emoji_test(path):
+    """[(group, subgroup, [emoji, ...]), ...] of the fully-qualified emojis in an emoji-test.txt."""
+    subgroups = []
+    group = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('# group:'):
+                group = line.split(':', 1)[1].strip()
+            elif line.startswith('# subgroup:'):
+                subgroups.append((group, line.split(':', 1)[1].strip(), []))
+            elif line.strip() and not line.startswith('#') and subgroups:
+                codepoints, _, status = line.partition(';')
+                if status.split('#', 1)[0].strip() != 'fully-qualified':
+                    continue
+                emoji = ''.join(chr(int(c, 16)) for c in codepoints.split())
+                if _SKIN_TONES.isdisjoint(emoji):
+                    subgroups[-1][2].append(emoji)
+    return [entry for entry in subgroups if entry[2]]
+
+
+def build_index(source=None, path=None):
+    """Compile emoji-test.txt into the pack index file. Returns the number of emojis written."""
+    source = source or source_path()
+    path = path or index_path()
+    if source is None:
+        raise FileNotFoundError('random_unicode_emoji is not installed, there is no emoji data to index')
+
+    data = bytearray()
+    toc = []
+    count = 0
+    for group, subgroup, emojis in parse_emoji_test(source):
+        blob = ' '.join(emojis).encode()
+        toc.append([group, subgroup, len(data), len(blob)])
+        data += blob
+        count += len(emojis)
+    header = json.dumps({
+        'format': INDEX_FORMAT,
+        'source_size': os.path.getsize(source),
+        'subgroups': toc,
+    }).encode()
+
+    # Written aside and renamed so a worker never maps a half-written index
+    partial = f'{path}.{os.getpid()}.tmp'
+    with open(partial, 'wb') as f:
+        f.write(header + b'\n' + data)
+    os.replace(partial, path)
+    return count
+
+
+class PackIndex:
+    """A mapped pack index file; subgroups are decoded only when asked for."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        end = self._map.find(b'\n')
+        self.header = json.loads(self._map[:end])
+        self._start = end + 1
+
+    def is_current(self, source):
+        return (self.header.get('format') == INDEX_FORMAT
+                and self.header.get('source_size') == os.path.getsize(source))
+
+    def categories(self, groups):
+        """{subgroup: [emoji, ...]} for the subgroups of groups, in file order."""
+        categories = {}
+        for group, subgroup, offset, length in self.header['subgroups']:
+            if group in groups:
+                start = self._start + offset
+                categories[subgroup] = self._map[start:start + length].decode().split(' ')
+        return categories
+
+    def close(self):
+        self._map.close()
+
+
+class PackLibrary:
+    """The packs of this worker, each loaded on first use."""
+
+    def __init__(self):
+        self._packs = {DEFAULT_PACK: catalog}
+        self._index = None
+        self._names = None
+        self._lock = threading.Lock()
+
+    def names(self):
+        if self._names is None:
+            if self._open_index() is None:
+                self._names = (DEFAULT_PACK,)
+            else:
+                self._names = (DEFAULT_PACK, *UNICODE_PACKS)
+        return self._names
+
+    def exists(self, name):
+        return isinstance(name, str) and name in self.names()
+
+    def get(self, name):
+        """The catalog of pack name, loading it if this worker hasn't yet. Raises KeyError for unknown packs."""
+        pack = self._packs.get(name)
+        if pack is not None:
+            return pack
+        groups = UNICODE_PACKS[name]
+        if not self.exists(name):
+            raise KeyError(name)
+        with self._lock:
+            pack = self._packs.get(name)
+            if pack is None:
+                pack = self._packs[name] = EmojiCatalog(self._index.categories(groups))
+        return pack
+
+    def _open_index(self):
+        """The mapped pack index, or None when there is no usable one."""
+        if self._index is not None:
+            return self._index
+        path = index_path()
+        try:
+            index = PackIndex(path)
+        except (OSError, ValueError) as e:
+            log.warning('emoji_pack_index_missing', path=path, error=repr(e),
+                        hint='run manage.py buildemojipacks')
+            return None
+        if index.header.get('format') != INDEX_FORMAT:
+            index.close()
+            log.warning('emoji_pack_index_outdated', path=path, hint='run manage.py buildemojipacks')
+            return None
+        source = source_path()
+        if source is not None and not index.is_current(source):
+            # Still a valid index, only of older emoji data
+            log.warning('emoji_pack_index_stale', path=path, hint='run manage.py buildemojipacks')
+        self._index = index
+        return index
+
+
+packs = PackLibrary()
@@ -0,0 +1,309 @@
+import json
+import struct
+
+COMPACT_SUBPROTOCOL = 'mimic.compact.v1'
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+# MessagePack subset: nil, bool, int, float, str, bin, array and map
+
+def packb(obj):
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def _pack(obj, out):
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xff)
+        elif 0 <= obj <= 0xff:
+            out += struct.pack('>BB', 0xcc, obj)
+        elif 0 <= obj <= 0xffff:
+            out += struct.pack('>BH', 0xcd, obj)
+        elif 0 <= obj <= 0xffffffff:
+            out += struct.pack('>BI', 0xce, obj)
+        elif 0 <= obj:
+            out += struct.pack('>BQ', 0xcf, obj)
+        elif -0x80 <= obj:
+            out += struct.pack('>Bb', 0xd0, obj)
+        elif -0x8000 <= obj:
+            out += struct.pack('>Bh', 0xd1, obj)
+        elif -0x80000000 <= obj:
+            out += struct.pack('>Bi', 0xd2, obj)
+        else:
+            out += struct.pack('>Bq', 0xd3, obj)
+    elif isinstance(obj, float):
+        out += struct.pack('>Bd', 0xcb, obj)
+    elif isinstance(obj, str):
+        data = obj.encode()
+        n = len(data)
+        if n < 32:
+            out.append(0xa0 | n)
+        elif n <= 0xff:
+            out += struct.pack('>BB', 0xd9, n)
+        elif n <= 0xffff:
+            out += struct.pack('>BH', 0xda, n)
+        else:
+            out += struct.pack('>BI', 0xdb, n)
+        out += data
+    elif isinstance(obj, (bytes, bytearray)):
+        n = len(obj)
+        if n <= 0xff:
+            out += struct.pack('>BB', 0xc4, n)
+        elif n <= 0xffff:
+            out += struct.pack('>BH', 0xc5, n)
+        else:
+            out += struct.pack('>BI', 0xc6, n)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            out.append(0x90 | n)
+        elif n <= 0xffff:
+            out += struct.pack('>BH', 0xdc, n)
+        else:
+            out += struct.pack('>BI', 0xdd, n)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        n = len(obj)
+        if n < 16:
+            out.append(0x80 | n)
+        elif n <= 0xffff:
+            out += struct.pack('>BH', 0xde, n)
+        else:
+            out += struct.pack('>BI', 0xdf, n)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f'Cannot pack {type(obj).__name__}')
+
+
+_FIXED = {
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+    0xca: '>f', 0xcb: '>d',
+}
+_LENGTHS = {
+    0xd9: '>B', 0xda: '>H', 0xdb: '>I',
+    0xc4: '>B', 0xc5: '>H', 0xc6: '>I',
+    0xdc: '>H', 0xdd: '>I', 0xde: '>H', 0xdf: '>I',
+}
+
+
+# Deepest nesting of arrays and maps accepted; client messages are a map of scalars
+MAX_DEPTH = 16
+
+
+def unpackb(data):
+    try:
+        obj, offset = _unpack(memoryview(data), 0)
+    except (IndexError, struct.error, UnicodeDecodeError, TypeError) as e:
+        # TypeError: an array or map used as a map key
+        raise ProtocolError(f'Malformed frame: {e}')
+    if offset != len(data):
+        raise ProtocolError('Trailing bytes in frame')
+    return obj
+
+
+def _unpack(data, offset, depth=0):
+    byte = data[offset]
+    offset += 1
+    if byte < 0x80:
+        return byte, offset
+    if byte >= 0xe0:
+        return byte - 0x100, offset
+    if 0x80 <= byte <= 0x9f or byte in (0xdc, 0xdd, 0xde, 0xdf):
+        if depth >= MAX_DEPTH:
+            raise ProtocolError('Frame is nested too deeply')
+    if 0x80 <= byte <= 0x8f:
+        return _unpack_map(data, offset, byte & 0x0f, depth + 1)
+    if 0x90 <= byte <= 0x9f:
+        return _unpack_array(data, offset, byte & 0x0f, depth + 1)
+    if 0xa0 <= byte <= 0xbf:
+        end = offset + (byte & 0x1f)
+        return str(data[offset:end], 'utf-8'), end
+    if byte == 0xc0:
+        return None, offset
+    if byte == 0xc2:
+        return False, offset
+    if byte == 0xc3:
+        return True, offset
+    if byte in _FIXED:
+        fmt = _FIXED[byte]
+        return struct.unpack_from(fmt, data, offset)[0], offset + struct.calcsize(fmt)
+    if byte in _LENGTHS:
+        fmt = _LENGTHS[byte]
+        n = struct.unpack_from(fmt, data, offset)[0]
+        offset += struct.calcsize(fmt)
+        if byte in (0xdc, 0xdd):
+            return _unpack_array(data, offset, n, depth + 1)
+        if byte in (0xde, 0xdf):
+            return _unpack_map(data, offset, n, depth + 1)
+        end = offset + n
+        if end > len(data):
+            raise IndexError('truncated')
+        if byte in (0xd9, 0xda, 0xdb):
+            return str(data[offset:end], 'utf-8'), end
+        return bytes(data[offset:end]), end
+    raise ProtocolError(f'Unsupported type byte 0x{byte:02x}')
+
+
+def _unpack_array(data, offset, n, depth):
+    items = []
+    for _ in range(n):
+        item, offset = _unpack(data, offset, depth)
+        items.append(item)
+    return items, offset
+
+
+def _unpack_map(data, offset, n, depth):
+    result = {}
+    for _ in range(n):
+        key, offset = _unpack(data, offset, depth)
+        value, offset = _unpack(data, offset, depth)
+        result[key] = value
+    return result, offset
+
+
+# Compact room protocol: numeric message types and short field ids.
+# Append only; existing numbers are part of the wire format.
+
+MESSAGE_TYPES = [
+    'connection_ready', 'user', 'create_room', 'room_created', 'join_room',
+    'joined_room', 'participants_updated', 'start_game', 'game_started',
+    'submit_guess', 'guess_result', 'guess_submitted', 'error',
+    'roster_sync', 'participants_snapshot', 'time_left', 'turn_ended',
+    'game_over', 'rate_limited', 'guesses_batch', 'resume', 'resumed',
+    'replay',
+]
+FIELDS = [
+    'type', 'room_id', 'participants', 'username', 'action', 'timer',
+    'rounds', 'current_turn', 'role', 'emoji', 'guess', 'correct',
+    'correct_emoji', 'message', 'hint', 'error', 'reconnect',
+    'version', 'added', 'removed', 'deltas', 'time_left', 'reason',
+    'round', 'scores', 'points', 'winners', 'deck',
+    'pack', 'retry_after', 'batches', 'guesses', 'resume_token',
+    'seq',
+]
+TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES)}
+FIELD_IDS = {name: code for code, name in enumerate(FIELDS)}
+
+# Prose the client can render itself from the other fields
+DERIVED_FIELDS = {
+    'connection_ready': {'message'},
+    'guess_result': {'message', 'hint'},
+    'guess_submitted': {'message'},
+}
+
+
+class JsonCodec:
+    name = 'json'
+    subprotocol = None
+
+    def encode(self, payload):
+        return {'text_data': json.dumps(payload)}
+
+    def frame(self, frames):
+        return {'text_data': frames['text']}
+
+
+class CompactCodec:
+    """
+    MessagePack binary frames keyed by FIELD_IDS, with the message type sent
+    as its TYPE_CODES number. Unknown fields and types fall back to their
+    names so the two ends can be upgraded independently.
+    """
+
+    name = 'compact'
+    subprotocol = COMPACT_SUBPROTOCOL
+
+    def pack(self, payload):
+        kind = payload.get('type')
+        skip = DERIVED_FIELDS.get(kind, ())
+        compact = {}
+        for key, value in payload.items():
+            if key in skip:
+                continue
+            if key == 'type':
+                value = TYPE_CODES.get(value, value)
+            compact[FIELD_IDS.get(key, key)] = value
+        return packb(compact)
+
+    def unpack(self, data):
+        compact = unpackb(data)
+        if not isinstance(compact, dict):
+            raise ProtocolError('Frame is not a map')
+        payload = {}
+        for key, value in compact.items():
+            if isinstance(key, int):
+                if not 0 <= key < len(FIELDS):
+                    raise ProtocolError(f'Unknown field id {key}')
+                key = FIELDS[key]
+            payload[key] = value
+        kind = payload.get('type')
+        if isinstance(kind, int):
+            if not 0 <= kind < len(MESSAGE_TYPES):
+                raise ProtocolError(f'Unknown message type {kind}')
+            payload['type'] = MESSAGE_TYPES[kind]
+        return payload
+
+    def encode(self, payload):
+        return {'bytes_data': self.pack(payload)}
+
+    def frame(self, frames):
+        data = frames.get('bytes')
+        if data is None:
+            # Encoded while the room had no compact sockets
+            data = self.pack(json.loads(frames['text']))
+        return {'bytes_data': data}
+
+
+JSON = JsonCodec()
+COMPACT = CompactCodec()
+
+
+def negotiate(subprotocols):
+    """Pick the codec for a socket from the subprotocols the client offered."""
+    if COMPACT_SUBPROTOCOL in (subprotocols or ()):
+        return COMPACT
+    return JSON
+
+
+def decode(text_data=None, bytes_data=None):
+    """
+    Decode an incoming frame; text frames are JSON whatever was negotiated.
+    Raises ProtocolError (or ValueError for bad JSON) unless it is a message:
+    an object with a string type.
+    """
+    if text_data is not None:
+        try:
+            data = json.loads(text_data)
+        except RecursionError:
+            raise ProtocolError('Frame is nested too deeply')
+    else:
+        data = COMPACT.unpack(bytes_data)
+    if not isinstance(data, dict) or not isinstance(data.get('type'), str):
+        raise ProtocolError('Message is not an object with a type')
+    return data
+
+
+def frames(payload, compact=True):
+    """Encode payload once per wire format, for sharing across a whole group."""
+    encoded = {'text': json.dumps(payload)}
+    if compact:
+        encoded['bytes'] = COMPACT.pack(payload)
+    return encoded
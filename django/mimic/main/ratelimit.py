@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+
+# Guesses per second and burst size, per socket and per room; a rate of 0 turns that limit off
+DEFAULTS = {
+    'socket_rate': 2,
+    'socket_burst': 5,
+    'room_rate': 20,
+    'room_burst': 40,
+}
+
+
+def rate_limit_settings():
+    return {**DEFAULTS, **getattr(settings, 'GUESS_RATE_LIMIT', {})}
+
+
+class TokenBucket:
+    """rate tokens a second, up to burst saved up; each allowed action takes one."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self):
+        """Seconds until the next token."""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+def guess_bucket(scope):
+    """A fresh bucket for 'socket' or 'room' guesses, or None when that limit is off."""
+    config = rate_limit_settings()
+    rate = config[f'{scope}_rate']
+    if not rate:
+        return None
+    return TokenBucket(rate, max(1, config[f'{scope}_burst']))
@@ -0,0 +1,74 @@
+import asyncio
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Room
+
+DEFAULTS = {
+    'empty_after': 10 * 60,
+    'finished_after': 60 * 60,
+    'max_age': 24 * 60 * 60,
+    'batch_size': 500,
+    'interval': 60,
+}
+
+
+def reaper_settings():
+    return {**DEFAULTS, **getattr(settings, 'ROOM_REAPER', {})}
+
+
+def expired_rooms(now=None, empty_after=None, finished_after=None, max_age=None):
+    """
+    Rooms nobody can still be playing in, by seconds since their state was
+    last written (Room.last_active): empty ones, finished ones, and any at
+    all that have been idle for max_age, such as rooms of a worker that died
+    with players in them.
+    """
+    config = reaper_settings()
+    now = now or timezone.now()
+    empty_after = config['empty_after'] if empty_after is None else empty_after
+    finished_after = config['finished_after'] if finished_after is None else finished_after
+    max_age = config['max_age'] if max_age is None else max_age
+    return Room.objects.filter(
+        Q(last_active__lt=now - timedelta(seconds=empty_after), members__isnull=True)
+        | Q(last_active__lt=now - timedelta(seconds=finished_after), gameState='finished')
+        | Q(last_active__lt=now - timedelta(seconds=max_age))
+    ).distinct()
+
+
+def reap_batch(batch_size=None, **criteria):
+    """Delete one batch of expired rooms in its own transaction. Returns the number of rooms deleted."""
+    batch_size = batch_size or reaper_settings()['batch_size']
+    with transaction.atomic():
+        ids = list(expired_rooms(**criteria).order_by('created_at').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        _, deleted = Room.objects.filter(id__in=ids).delete()
+    return deleted.get(Room._meta.label, 0)
+
+
+async def reap_rooms(batch_size=None, **criteria):
+    """Delete every expired room, batch by batch so no transaction holds the database for long."""
+    total = 0
+    while True:
+        deleted = await sync_to_async(reap_batch)(batch_size, **criteria)
+        total += deleted
+        if not deleted:
+            return total
+        # Let writers from the game in between batches
+        await asyncio.sleep(0)
+
+
+async def run_reaper(interval=None, report=None, batch_size=None):
+    """Reap forever, every interval seconds."""
+    interval = interval or reaper_settings()['interval']
+    while True:
+        reclaimed = await reap_rooms(batch_size)
+        if report is not None:
+            report(reclaimed)
+        await asyncio.sleep(interval)
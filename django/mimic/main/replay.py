@@ -0,0 +1,65 @@
+"""
+Recent broadcasts of each room, numbered, for clients that missed some.
+
+Every room broadcast except time_left and roster changes (which have
+roster_sync) gets the room's next seq in its payload, and the group event
+that carried it is kept in the room's EventRing. A client sends
+{'type': 'replay', 'seq': <last seq it saw>}, or seq with resume, and the
+events after that are handled again for its socket alone, so it gets its
+own variant of each. A ring holds at most `events` events and `bytes` bytes
+of encoded frames, oldest out first; anything older is gone.
+"""
+import collections
+
+from django.conf import settings
+
+DEFAULTS = {
+    'events': 128,
+    'bytes': 64 * 1024,
+}
+
+
+def ring_settings():
+    return {**DEFAULTS, **getattr(settings, 'ROOM_EVENT_RING', {})}
+
+
+def frames_size(*encoded):
+    """Bytes held by frames dicts from main.protocol.frames()."""
+    return sum(len(data) for frames in encoded for data in frames.values())
+
+
+class EventRing:
+    __slots__ = ('events', 'seq', 'size', 'max_events', 'max_bytes')
+
+    def __init__(self, max_events=DEFAULTS['events'], max_bytes=DEFAULTS['bytes']):
+        # (seq, group event, size)
+        self.events = collections.deque()
+        self.seq = 0
+        self.size = 0
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_settings(cls):
+        config = ring_settings()
+        return cls(config['events'], config['bytes'])
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def append(self, seq, event, size):
+        self.events.append((seq, event, size))
+        self.size += size
+        while self.events and (len(self.events) > self.max_events or self.size > self.max_bytes):
+            self.size -= self.events.popleft()[2]
+
+    def since(self, seq):
+        """Group events after seq still held, oldest first."""
+        missed = []
+        for entry_seq, event, _ in reversed(self.events):
+            if entry_seq <= seq:
+                break
+            missed.append(event)
+        missed.reverse()
+        return missed
@@ -0,0 +1,36 @@
+"""
+Resume tokens, handed out with room_created and joined_room.
+
+A token is a signed (room id, username). A socket that drops is kept in its
+room for resume_grace() seconds; a new socket sending
+{'type': 'resume', 'resume_token': ...} in that time takes its place from
+the worker's memory, without the user/join_room round trips, a database
+read or a roster change.
+"""
+from django.conf import settings
+from django.core import signing
+
+SALT = 'main.resume'
+
+# Past this a token is refused even if its user is somehow still in the room
+TOKEN_MAX_AGE = 24 * 60 * 60
+
+
+def resume_grace():
+    """Seconds a dropped socket's user stays in the room; 0 makes every disconnect a leave."""
+    return getattr(settings, 'RESUME_GRACE', 15)
+
+
+def make_token(room_id, username):
+    return signing.dumps([room_id, username], salt=SALT)
+
+
+def read_token(token):
+    """(room_id, username) of a valid token, else None."""
+    if not isinstance(token, str):
+        return None
+    try:
+        room_id, username = signing.loads(token, salt=SALT, max_age=TOKEN_MAX_AGE)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    return room_id, username
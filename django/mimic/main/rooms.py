@@ -0,0 +1,276 @@
+import asyncio
+import collections
+import time
+from django.db import IntegrityError
+from django.utils import timezone
+from . import affinity, store
+from .decks import Deck
+from .log import get_logger
+from .metrics import metrics
+from .models import Participant, Room, generate_room_id
+from .ratelimit import guess_bucket
+from .replay import EventRing
+
+log = get_logger(__name__)
+
+
+class RoomState:
+    """Live state of a room, shared by every socket of that room in this process."""
+
+    # Roster changes kept for catching up clients; older gaps get a full snapshot
+    roster_log_size = 64
+
+    def __init__(self, id, rounds=3, timer=90, participants=None,
+                 currentTurn=None, currentEmoji=None, gameState='waiting', currentRound=0, deckState=''):
+        self.id = id
+        self.rounds = rounds
+        self.timer = timer
+        self.participants = list(participants or [])
+        self._members = set(self.participants)
+        self.currentTurn = currentTurn
+        self.currentEmoji = currentEmoji
+        self.gameState = gameState
+        self.currentRound = currentRound
+        # main.game.Game while a game is running here
+        self.game = None
+        # Bumped by every turn, so an expiry that lost a race to a guess can tell it is stale
+        self.turn_id = 0
+        self.deckState = deckState
+        self._deck = None
+        # Budget for broadcasting wrong guesses, shared by every socket of the room
+        self.guess_bucket = guess_bucket('room')
+        # Wrong guesses waiting for the next guesses_batch, and the timer that sends it
+        self.pending_guesses = []
+        self.guess_flush = None
+        # Sockets here that negotiated the compact protocol; broadcasts skip that encoding when zero
+        self.compact_sockets = 0
+        self.roster_version = 0
+        self.roster_log = collections.deque(maxlen=self.roster_log_size)
+        # username -> joined (True) or left (False) since the last flush
+        self.pending_roster = {}
+        # Room fields changed since the last flush
+        self.changed_fields = set()
+        # username -> score, set at round boundaries
+        self.pending_scores = {}
+        # Recent broadcasts, numbered, for clients catching up (main.replay)
+        self.events = EventRing.from_settings()
+        # username -> open sockets here, and the departure timers of users whose sockets all dropped
+        self.sockets = {}
+        self.departing = {}
+        # Feed frames dropped for, and sockets closed as, slow readers (see main.outbox)
+        self.dropped_frames = 0
+        self.evicted_sockets = 0
+
+    @classmethod
+    def from_model(cls, room, participants=()):
+        return cls(
+            id=room.id,
+            rounds=room.rounds,
+            timer=room.timer,
+            participants=participants,
+            currentTurn=room.currentTurn,
+            currentEmoji=room.currentEmoji,
+            gameState=room.gameState,
+            currentRound=room.currentRound,
+            deckState=room.deckState,
+        )
+
+    @property
+    def deck(self):
+        """The main.decks.Deck this room deals from, restored from deckState on first use."""
+        if self._deck is None:
+            self._deck = Deck.loads(self.deckState)
+        return self._deck
+
+    def set_deck(self, deck):
+        self._deck = deck
+        self.update(deckState=deck.dumps())
+
+    def update(self, **fields):
+        """Set persisted fields; only these are written on the next flush."""
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.changed_fields.update(fields)
+
+    def take_changes(self):
+        """Values of the fields changed since the last call, safe to hand to a background save."""
+        changes = {name: getattr(self, name) for name in self.changed_fields}
+        self.changed_fields = set()
+        return changes
+
+    def has_participant(self, username):
+        return username in self._members
+
+    def add_participant(self, username):
+        if username in self._members:
+            return False
+        self._members.add(username)
+        self.participants.append(username)
+        self._log_roster(username, True)
+        return True
+
+    def remove_participant(self, username):
+        if username not in self._members:
+            return False
+        self._members.discard(username)
+        self.participants.remove(username)
+        self._log_roster(username, False)
+        return True
+
+    def _log_roster(self, username, added):
+        self.pending_roster[username] = added
+        self.roster_version += 1
+        self.roster_log.append((self.roster_version, username, added))
+
+    def roster_changes_since(self, version):
+        """Net (added, removed) since version, or None when the log no longer reaches back that far."""
+        if version == self.roster_version:
+            return [], []
+        if version > self.roster_version or not self.roster_log or self.roster_log[0][0] > version + 1:
+            return None
+        added, removed = {}, {}
+        for entry_version, username, was_added in self.roster_log:
+            if entry_version <= version:
+                continue
+            if was_added:
+                if removed.pop(username, None) is None:
+                    added[username] = True
+            elif added.pop(username, None) is None:
+                removed[username] = True
+        return list(added), list(removed)
+
+
+class RoomRegistry:
+    """
+    Process-local source of truth for live rooms.
+
+    Consumers mutate the shared RoomState directly; the Room rows are written
+    behind them by a background flush so no database round trip sits on the
+    message path.
+    """
+
+    def __init__(self, flush_delay=0.05):
+        self.flush_delay = flush_delay
+        self.rooms = {}
+        self._loading = {}
+        self._dirty = set()
+        self._flush_handle = None
+        self._flush_task = None
+
+    async def create(self, attempts=5):
+        for attempt in range(attempts):
+            # Under room affinity only ids pinned to this worker are handed out
+            room_id = generate_room_id()
+            while not affinity.owns_room(room_id):
+                room_id = generate_room_id()
+            start = time.perf_counter() if metrics.enabled else None
+            try:
+                room = await Room.objects.acreate(id=room_id)
+                break
+            except IntegrityError:
+                # Another process with the same node letter got there first
+                if attempt == attempts - 1:
+                    raise
+            finally:
+                if start is not None:
+                    metrics.db.observe_since(start, 'create_room')
+        state = RoomState.from_model(room)
+        self.rooms[state.id] = state
+        return state
+
+    async def get(self, room_id):
+        """Return the live state for room_id, loading it once if needed. Raises Room.DoesNotExist."""
+        state = self.rooms.get(room_id)
+        if state is not None:
+            return state
+
+        # Concurrent joins of a cold room share one load
+        loading = self._loading.get(room_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(room_id))
+            self._loading[room_id] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(room_id, None))
+        loaded = await asyncio.shield(loading)
+
+        state = self.rooms.get(room_id)
+        if state is None:
+            state = self.rooms[room_id] = loaded
+            if state.changed_fields:
+                self.save(state)
+        return state
+
+    async def _load(self, room_id):
+        start = time.perf_counter() if metrics.enabled else None
+        room = await Room.objects.aget(id=room_id)
+        participants = [
+            username async for username in Participant.objects
+            .filter(room_id=room_id)
+            .order_by('joined_at', 'id')
+            .values_list('username', flat=True)
+        ]
+        if start is not None:
+            metrics.db.observe_since(start, 'load_room')
+        state = RoomState.from_model(room, participants)
+        if state.gameState == 'in_progress':
+            # Games live only in the memory of the worker that ran them; this one is gone
+            state.update(gameState='waiting', currentTurn=None, currentEmoji=None)
+        return state
+
+    def save(self, state):
+        """Mark state as changed; it is persisted on the next background flush."""
+        self._dirty.add(state.id)
+        self._schedule_flush()
+
+    def release(self, state):
+        """Drop an empty room from memory once its last change has been flushed."""
+        if not state.participants and state.id not in self._dirty:
+            self.rooms.pop(state.id, None)
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None or self._flush_task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+        self._flush_task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self._flush_task = None
+        if not task.cancelled() and task.exception() is not None:
+            log.error('room_flush_failed', error=repr(task.exception()))
+        if self._dirty:
+            self._schedule_flush()
+
+    async def flush(self):
+        """Write every dirty room to the database."""
+        while self._dirty:
+            room_id = self._dirty.pop()
+            state = self.rooms.get(room_id)
+            if state is None:
+                continue
+            fields = state.take_changes()
+            roster, state.pending_roster = state.pending_roster, {}
+            scores, state.pending_scores = state.pending_scores, {}
+            try:
+                await store.update_room(room_id, {**fields, 'last_active': timezone.now()})
+                await store.add_participants(room_id, [name for name, joined in roster.items() if joined])
+                await store.remove_participants(room_id, [name for name, joined in roster.items() if not joined])
+                await store.update_scores(room_id, scores)
+            except IntegrityError:
+                # The row was reaped underneath us; nothing left to write to
+                log.warning('room_flush_dropped', room_id=room_id)
+                continue
+            except Exception:
+                # Keep anything that changed again while we were writing
+                state.changed_fields.update(fields)
+                state.pending_roster = {**roster, **state.pending_roster}
+                state.pending_scores = {**scores, **state.pending_scores}
+                self._dirty.add(room_id)
+                raise
+            self.release(state)
+
+
+registry = RoomRegistry()
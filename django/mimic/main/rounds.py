@@ -0,0 +1,67 @@
+import asyncio
+import math
+
+from django.conf import settings
+
+from . import fanout
+from .timers import wheel
+
+
+class RoundClock:
+    """
+    Server-side round deadlines for every room of this worker.
+
+    Each running room holds one timer in the shared wheel for its deadline,
+    and a single ticker, alive only while some round is running, broadcasts
+    time_left to all of them every tick_interval seconds.
+    """
+
+    def __init__(self):
+        self.rounds = {}
+        self._ticker = None
+
+    @property
+    def tick_interval(self):
+        return getattr(settings, 'ROUND_TICK_INTERVAL', 5)
+
+    def start(self, room, on_expire, *args):
+        """(Re)start room's round for room.timer seconds; on_expire(room, *args) runs when it runs out."""
+        self.stop(room)
+        deadline = asyncio.get_running_loop().time() + room.timer
+        self.rounds[room.id] = (room, deadline, wheel.call_at(deadline, self._expire, room, on_expire, args))
+        if self._ticker is None and self.tick_interval:
+            self._ticker = wheel.call_later(self.tick_interval, self._tick)
+
+    def stop(self, room):
+        entry = self.rounds.pop(room.id, None)
+        if entry is not None:
+            entry[2].cancel()
+
+    def time_left(self, room):
+        entry = self.rounds.get(room.id)
+        if entry is None:
+            return None
+        return max(0, math.ceil(entry[1] - asyncio.get_running_loop().time()))
+
+    def _expire(self, room, on_expire, args):
+        self.rounds.pop(room.id, None)
+        return on_expire(room, *args)
+
+    async def _tick(self):
+        self._ticker = None
+        if not self.rounds:
+            return
+        self._ticker = wheel.call_later(self.tick_interval, self._tick)
+        for room, _, _ in list(self.rounds.values()):
+            time_left = self.time_left(room)
+            if time_left is None:
+                continue
+            await fanout.broadcast(room, {
+                'type': 'time_left',
+                'room_id': room.id,
+                'current_turn': room.currentTurn,
+                'time_left': time_left
+            }, feed=True, key='time_left', replay=False)
+
+
+clock = RoundClock()
@@ -0,0 +1,235 @@
+"""
+Room operations used by RoomConsumer.
+
+Each operation changes the shared RoomState in one step of the event loop, so
+concurrent sockets can't interleave a read and a write, and reaches the
+database through main.store as single insert/delete/update statements.
+"""
+from . import fanout
+from .decks import Deck
+from .game import ACTOR_POINTS, GUESS_POINTS, Game
+from .models import Participant
+from .packs import DEFAULT_PACK
+from .rooms import registry
+from .rounds import clock
+from .timers import wheel
+
+
+def valid_username(username):
+    """Whether username can be a participant: a non-empty string that fits the Participant row."""
+    return (isinstance(username, str)
+            and 0 < len(username) <= Participant._meta.get_field('username').max_length)
+
+
+async def create_room(username, deck='all', pack=DEFAULT_PACK):
+    """
+    Create a room with username in it, dealing from the named deck of pack.
+    Returns (room, roster_version). Raises ValueError for an invalid username.
+    """
+    # Checked first: a room registered without its creator would never be released
+    if not valid_username(username):
+        raise ValueError(f'Invalid username {username!r}')
+    room = await registry.create()
+    room.set_deck(Deck(deck, pack=pack))
+    room.add_participant(username)
+    registry.save(room)
+    return room, room.roster_version
+
+
+async def join_room(room_id, username):
+    """
+    Add username to a room. Raises Room.DoesNotExist.
+
+    Returns (room, joined, roster_version); joined is False when username
+    was already in the room.
+    """
+    room = await registry.get(room_id)
+    joined = room.add_participant(username)
+    if joined:
+        registry.save(room)
+    return room, joined, room.roster_version
+
+
+def leave_room(room, username):
+    """Remove username from room. Returns the new roster version, or None if they weren't in it."""
+    if not room.remove_participant(username):
+        return None
+    if not room.participants:
+        clock.stop(room)
+        end_game(room)
+    registry.save(room)
+    return room.roster_version
+
+
+def attach(room, username):
+    """Count a socket of username in room, calling off their departure if one is pending."""
+    room.sockets[username] = room.sockets.get(username, 0) + 1
+    timer = room.departing.pop(username, None)
+    if timer is not None:
+        timer.cancel()
+
+
+def detach(room, username):
+    """Uncount a socket of username. Returns True when it was their last one in room."""
+    count = room.sockets.get(username, 0) - 1
+    if count > 0:
+        room.sockets[username] = count
+        return False
+    room.sockets.pop(username, None)
+    return True
+
+
+def resume(room_id, username):
+    """
+    Put a new socket of username back in a live room of this worker, from
+    memory only. Returns the room, or None when it isn't held here or
+    username has already left it.
+    """
+    room = registry.rooms.get(room_id)
+    if room is None or not room.has_participant(username):
+        return None
+    attach(room, username)
+    return room
+
+
+def depart_later(room, username, grace):
+    """Have username leave room in grace seconds unless a socket of theirs comes back first."""
+    timer = room.departing.pop(username, None)
+    if timer is not None:
+        timer.cancel()
+    room.departing[username] = wheel.call_later(grace, _grace_expired, room, username)
+
+
+async def _grace_expired(room, username):
+    room.departing.pop(username, None)
+    await depart(room, username)
+
+
+async def depart(room, username):
+    """Take username out of room and tell everyone; ends the turn if they were acting."""
+    turn_id = room.turn_id
+    version = leave_room(room, username)
+    if version is None:
+        return
+    await fanout.broadcast_roster(room, username, 'user_left', version)
+    if room.game is not None and room.currentTurn == username:
+        # Nobody is left to act out this emoji
+        await end_turn(room, 'actor_left', turn_id)
+
+
+def end_game(room):
+    """Drop the game running in room, if any, and put the room back to waiting."""
+    room.game = None
+    if room.gameState == 'in_progress':
+        room.update(gameState='waiting', currentTurn=None, currentEmoji=None)
+
+
+def start_game(room):
+    """
+    Start a game of room.rounds rounds in which every participant acts once
+    per round. Returns False when a game is already running.
+    """
+    if room.game is not None:
+        return False
+    room.game = Game(room.participants)
+    room.update(currentRound=1)
+    start_turn(room, room.game.actor, deal(room))
+    return True
+
+
+def deal(room):
+    """Next emoji from the room's deck; no emoji comes up twice before the deck is through."""
+    emoji = room.deck.draw()
+    room.update(deckState=room.deck.dumps())
+    return emoji
+
+
+def start_turn(room, actor, emoji):
+    """Give actor the emoji and start the server-side clock for the turn."""
+    room.update(currentTurn=actor, currentEmoji=emoji, gameState='in_progress')
+    room.turn_id += 1
+    registry.save(room)
+    clock.start(room, end_turn, 'timeout', room.turn_id)
+
+
+def submit_guess(room, username, guess):
+    """
+    Check username's guess. A right one scores and closes the turn before
+    anyone else can guess again.
+
+    Returns (correct, points, ended), where ended is None or what
+    announce_turn_end needs to tell the room.
+    """
+    if room.game is None or not room.deck.catalog.matches(guess, room.currentEmoji):
+        return False, 0, None
+    room.game.scores.award(username, GUESS_POINTS)
+    room.game.scores.award(room.currentTurn, ACTOR_POINTS)
+    return True, GUESS_POINTS, finish_turn(room, 'guessed', username)
+
+
+def finish_turn(room, reason, winner=None):
+    """
+    Close the current turn and move the game on to the next actor, round or
+    the end of the game, all without yielding to the event loop.
+
+    Returns (turn_ended, game_over) payloads; game_over is None unless that
+    was the last turn.
+    """
+    clock.stop(room)
+    game = room.game
+    ended = {
+        'type': 'turn_ended',
+        'room_id': room.id,
+        'current_turn': room.currentTurn,
+        'emoji': room.currentEmoji,
+        'reason': reason,
+        'round': room.currentRound,
+        'rounds': room.rounds,
+        'scores': game.scores.as_dict()
+    }
+    if winner is not None:
+        ended['username'] = winner
+
+    step = game.advance(room)
+    if step != 'turn':
+        # Scores only reach the database at round boundaries
+        room.pending_scores = game.scores.as_dict()
+    if step == 'finished':
+        room.game = None
+        room.update(currentTurn=None, currentEmoji=None, gameState='finished')
+        registry.save(room)
+        return ended, {
+            'type': 'game_over',
+            'room_id': room.id,
+            'rounds': room.rounds,
+            'scores': room.pending_scores,
+            'winners': game.scores.winners()
+        }
+    if step == 'round':
+        room.update(currentRound=room.currentRound + 1)
+    start_turn(room, game.actor, deal(room))
+    return ended, None
+
+
+async def announce_turn_end(room, ended, game_over):
+    """Tell the room how the turn went, then who acts next or how the game finished."""
+    await fanout.flush_guesses(room)
+    await fanout.broadcast(room, ended)
+    if game_over is not None:
+        await fanout.broadcast(room, game_over)
+    else:
+        await fanout.broadcast_game_started(room, clock.time_left(room))
+
+
+async def end_turn(room, reason='timeout', turn_id=None):
+    """
+    Close the current turn without a winner, e.g. when its clock runs out.
+    With turn_id, only if that turn is still the current one: an expiry runs
+    as its own task, and a right guess may have moved the game on first.
+    """
+    if turn_id is not None and turn_id != room.turn_id:
+        return
+    if room.game is None:
+        clock.stop(room)
+        return
+    await announce_turn_end(room, *finish_turn(room, reason))
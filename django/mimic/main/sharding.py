@@ -0,0 +1,34 @@
+import bisect
+import hashlib
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash ring mapping keys onto a fixed list of nodes."""
+
+    def __init__(self, nodes, replicas=64):
+        if not nodes:
+            raise ValueError('HashRing needs at least one node')
+        self.nodes = list(nodes)
+        self._points = []
+        self._owners = []
+        ring = sorted(
+            (_hash(f'{node}#{i}'), index)
+            for index, node in enumerate(self.nodes)
+            for i in range(replicas)
+        )
+        for point, index in ring:
+            self._points.append(point)
+            self._owners.append(index)
+
+    def index_for(self, key):
+        if len(self.nodes) == 1:
+            return 0
+        position = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[position]
+
+    def node_for(self, key):
+        return self.nodes[self.index_for(key)]
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from django.db import OperationalError
+from django.db.models import Case, F, Value, When
+
+from .metrics import metrics
+from .models import Participant, Room
+
+# SQLite reports a busy writer as "database is locked"; those are retried
+LOCK_RETRIES = 5
+LOCK_BACKOFF = 0.02
+
+
+async def _retry(name, operation):
+    start = time.perf_counter() if metrics.enabled else None
+    try:
+        return await _attempt(operation)
+    finally:
+        if start is not None:
+            metrics.db.observe_since(start, name)
+
+
+async def _attempt(operation):
+    for attempt in range(LOCK_RETRIES):
+        try:
+            return await operation()
+        except OperationalError as e:
+            if 'locked' not in str(e) or attempt == LOCK_RETRIES - 1:
+                raise
+            await asyncio.sleep(LOCK_BACKOFF * 2 ** attempt)
+
+
+async def add_participants(room_id, usernames):
+    """Insert memberships in one statement; rows that already exist are left alone."""
+    if not usernames:
+        return
+    await _retry('add_participants', lambda: Participant.objects.abulk_create(
+        [Participant(room_id=room_id, username=username) for username in usernames],
+        ignore_conflicts=True,
+    ))
+
+
+async def remove_participants(room_id, usernames):
+    """Delete memberships in one statement. Returns how many rows went away."""
+    if not usernames:
+        return 0
+    deleted, _ = await _retry(
+        'remove_participants', lambda: Participant.objects.filter(room_id=room_id, username__in=usernames).adelete()
+    )
+    return deleted
+
+
+async def update_room(room_id, fields):
+    """Write only the given Room fields in a single UPDATE, so other fields are never overwritten with stale values."""
+    if not fields:
+        return
+    await _retry('update_room', lambda: Room.objects.filter(id=room_id).aupdate(**fields))
+
+
+async def update_scores(room_id, scores):
+    """Write a room's scores (username -> points) in a single UPDATE; players who left have no row and are skipped."""
+    if not scores:
+        return
+    await _retry('update_scores', lambda: Participant.objects.filter(room_id=room_id, username__in=list(scores)).aupdate(
+        score=Case(*[When(username=username, then=Value(points)) for username, points in scores.items()], default=F('score'))
+    ))
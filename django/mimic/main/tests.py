@@ -1,3 +1,1042 @@
-from django.test import TestCase
+import asyncio
+import collections
+import functools
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import decks, fanout, services, store
+from .decks import Deck, deck_exists
+from .emojis import catalog, charadesCategories, normalize
+from .layers import LocalChannelLayer
+from .metrics import metrics
+from .models import Participant, Room, RoomIdAllocator
+from .outbox import Outbox, server_buffer
+from .packs import PackLibrary, source_path
+from .protocol import COMPACT, JSON, ProtocolError, decode, frames, packb, unpackb
+from .ratelimit import TokenBucket, guess_bucket
+from .reaper import reap_batch
+from .replay import EventRing
+from .resume import make_token
+from .rooms import RoomRegistry, RoomState, registry
+from .rounds import clock
+from .timers import TimerWheel, wheel
+
+
+def reset_loop_state():
+    """Forget timers and pending flushes tied to the event loop of the test that just ran."""
+    for room, _, timer in list(clock.rounds.values()):
+        timer.cancel()
+    clock.rounds.clear()
+    clock._ticker = None
+    wheel._heap.clear()
+    wheel._handle = wheel._handle_when = None
+    if registry._flush_handle is not None:
+        registry._flush_handle.cancel()
+        registry._flush_handle = None
+    registry._dirty.clear()
+
+
+async def connect(path='/ws/room/'):
+    from mimic.asgi import application
+    communicator = WebsocketCommunicator(application, path, headers=[(b'origin', b'http://localhost')])
+    connected, _ = await communicator.connect()
+    assert connected
+    return communicator
+
+
+async def open_room(host, *players):
+    """Sockets of host, who created a room, and of players who joined it, past their join frames."""
+    sockets = []
+    for username in (host, *players):
+        communicator = await connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'user', 'username': username})
+        if not sockets:
+            await communicator.send_json_to({'type': 'create_room'})
+            room_id = (await communicator.receive_json_from())['room_id']
+        else:
+            await communicator.send_json_to({'type': 'join_room', 'room_id': room_id})
+            await communicator.receive_json_from()
+        sockets.append(communicator)
+        # Everyone in the room, the newcomer too, hears of the join
+        for member in sockets:
+            await member.receive_json_from()
+    return room_id, sockets
+
+
+class BlockingSend:
+    """An ASGI send that doesn't return until released, like a peer that stopped reading."""
+
+    def __init__(self):
+        self.sent = []
+        self.released = asyncio.Event()
+
+    async def __call__(self, text_data=None, bytes_data=None):
+        await self.released.wait()
+        self.sent.append(text_data)
+
+
+class OutboxTests(SimpleTestCase):
+    async def test_sends_in_order(self):
+        send = BlockingSend()
+        send.released.set()
+        outbox = Outbox(send)
+        for text in ('a', 'b', 'c'):
+            outbox.put({'text_data': text})
+        await asyncio.sleep(0)
+        self.assertEqual(send.sent, ['a', 'b', 'c'])
+        self.assertIsNone(outbox.writer)
+
+    async def test_drops_oldest_feed_and_keeps_state(self):
+        send = BlockingSend()
+        drops = []
+        outbox = Outbox(send, on_drop=lambda: drops.append(1), feed_limit=2)
+        outbox.put({'text_data': 'state1'})
+        for n in range(4):
+            outbox.put({'text_data': f'feed{n}'}, feed=True)
+        outbox.put({'text_data': 'state2'})
+        await asyncio.sleep(0)
+        send.released.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(send.sent, ['state1', 'feed2', 'feed3', 'state2'])
+        self.assertEqual(len(drops), 2)
+
+    async def test_keyed_feed_is_replaced(self):
+        send = BlockingSend()
+        outbox = Outbox(send)
+        outbox.put({'text_data': 'state'})
+        await asyncio.sleep(0)
+        outbox.put({'text_data': 'time_left 30'}, feed=True, key='time_left')
+        outbox.put({'text_data': 'time_left 25'}, feed=True, key='time_left')
+        send.released.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(send.sent, ['state', 'time_left 25'])
+
+    async def test_evicts_socket_stuck_past_slow_after(self):
+        send = BlockingSend()
+        evicted = []
+        outbox = Outbox(send, on_slow=evicted.append, slow_after=0.05)
+        outbox.put({'text_data': 'a'})
+        outbox.put({'text_data': 'b'})
+        await asyncio.sleep(0.1)
+        self.assertEqual(evicted, [])
+        outbox.put({'text_data': 'c'})
+        self.assertEqual(evicted, [1])
+        self.assertTrue(outbox.closed)
+        outbox.put({'text_data': 'd'})
+        self.assertEqual(evicted, [1])
+
+    async def test_evicts_past_state_limit(self):
+        send = BlockingSend()
+        evicted = []
+        outbox = Outbox(send, on_slow=evicted.append, state_limit=3)
+        for n in range(5):
+            outbox.put({'text_data': str(n)})
+        self.assertEqual(len(evicted), 1)
+        self.assertTrue(outbox.closed)
+
+    async def test_holds_frames_while_server_buffer_is_full(self):
+        # Daphne's send never waits; a full transport buffer is the only sign of a slow peer
+        sent = []
+        buffer = [100]
+
+        async def send(text_data=None, bytes_data=None):
+            sent.append(text_data)
+
+        drops, evicted = [], []
+        outbox = Outbox(send, lambda: drops.append(1), evicted.append, buffered=lambda: buffer[0],
+                        feed_limit=1, slow_after=0.2, buffer_limit=50)
+        outbox.put({'text_data': 'state'})
+        outbox.put({'text_data': 'feed1'}, feed=True)
+        outbox.put({'text_data': 'feed2'}, feed=True)
+        await asyncio.sleep(0.06)
+        self.assertEqual(sent, [])
+        self.assertEqual(len(drops), 1)
+
+        buffer[0] = 0
+        await asyncio.sleep(0.1)
+        self.assertEqual(sent, ['state', 'feed2'])
+
+        buffer[0] = 100
+        outbox.put({'text_data': 'stuck'})
+        await asyncio.sleep(0.35)
+        self.assertEqual(len(evicted), 1)
+        self.assertTrue(outbox.closed)
+        self.assertEqual(sent, ['state', 'feed2'])
+
+
+class ServerBufferTests(SimpleTestCase):
+    def test_reads_twisted_transport_buffer(self):
+        class Transport:
+            dataBuffer = b'x' * 10
+            offset = 4
+            _tempDataLen = 7
+
+        class Protocol:
+            transport = Transport()
+
+        async def handle_reply(protocol, message):
+            pass
+
+        buffered = server_buffer(functools.partial(handle_reply, Protocol()))
+        self.assertEqual(buffered(), 13)
+
+    def test_unknown_servers_give_none(self):
+        async def send(message):
+            pass
+
+        self.assertIsNone(server_buffer(send))
+        self.assertIsNone(server_buffer(functools.partial(send)))
+
+
+class LocalChannelLayerTests(SimpleTestCase):
+    async def test_send_and_receive(self):
+        layer = LocalChannelLayer()
+        channel = await layer.new_channel()
+        await layer.send(channel, {'type': 'a'})
+        await layer.send(channel, {'type': 'b'})
+        self.assertEqual(await layer.receive(channel), {'type': 'a'})
+        self.assertEqual(await layer.receive(channel), {'type': 'b'})
+        self.assertEqual(layer.queue_lengths(), {})
+
+    async def test_send_resolves_waiting_receive(self):
+        layer = LocalChannelLayer()
+        channel = await layer.new_channel()
+        receive = asyncio.ensure_future(layer.receive(channel))
+        await asyncio.sleep(0)
+        message = {'type': 'a'}
+        await layer.send(channel, message)
+        self.assertIs(await receive, message)
+
+    async def test_group_send_shares_one_message(self):
+        layer = LocalChannelLayer()
+        first, second, outsider = [await layer.new_channel() for _ in range(3)]
+        await layer.group_add('room', first)
+        await layer.group_add('room', second)
+        message = {'type': 'a'}
+        await layer.group_send('room', message)
+        self.assertIs(await layer.receive(first), message)
+        self.assertIs(await layer.receive(second), message)
+        self.assertNotIn(outsider, layer.queue_lengths())
+
+        await layer.group_discard('room', second)
+        await layer.group_send('room', {'type': 'b'})
+        self.assertEqual(layer.queue_lengths(), {first: 1})
+
+    async def test_full_channels_drop_group_messages(self):
+        layer = LocalChannelLayer(capacity=1)
+        channel = await layer.new_channel()
+        await layer.group_add('room', channel)
+        await layer.group_send('room', {'type': 'a'})
+        await layer.group_send('room', {'type': 'b'})
+        self.assertEqual(layer.dropped, 1)
+        self.assertEqual(await layer.receive(channel), {'type': 'a'})
+
+    async def test_unread_messages_expire_with_their_memberships(self):
+        layer = LocalChannelLayer(expiry=0.05, sweep_interval=0.05)
+        channel = await layer.new_channel()
+        await layer.group_add('room', channel)
+        await layer.send(channel, {'type': 'a'})
+        await asyncio.sleep(0.2)
+        self.assertEqual(layer.queue_lengths(), {})
+        self.assertEqual(layer.group_size('room'), 0)
+
+    async def test_discarded_memberships_do_not_pile_up(self):
+        layer = LocalChannelLayer()
+        staying = await layer.new_channel()
+        await layer.group_add('room', staying)
+        for _ in range(1000):
+            channel = await layer.new_channel()
+            await layer.group_add('room', channel)
+            await layer.group_discard('room', channel)
+        self.assertLessEqual(len(layer._group_expiry_heap), 2)
+        self.assertEqual(layer.group_size('room'), 1)
+
+    async def test_group_memberships_expire(self):
+        layer = LocalChannelLayer(group_expiry=0.05, sweep_interval=0.05)
+        channel = await layer.new_channel()
+        await layer.group_add('room', channel)
+        self.assertEqual(layer.group_size('room'), 1)
+        await asyncio.sleep(0.2)
+        self.assertEqual(layer.group_size('room'), 0)
+
+
+class EventRingTests(SimpleTestCase):
+    def fill(self, ring, count, size=10):
+        for _ in range(count):
+            seq = ring.next_seq()
+            ring.append(seq, {'seq': seq}, size)
+
+    def test_keeps_at_most_max_events(self):
+        ring = EventRing(max_events=3, max_bytes=1000)
+        self.fill(ring, 5)
+        self.assertEqual([event['seq'] for event in ring.since(0)], [3, 4, 5])
+        self.assertEqual(ring.size, 30)
+
+    def test_keeps_at_most_max_bytes(self):
+        ring = EventRing(max_events=100, max_bytes=25)
+        self.fill(ring, 5)
+        self.assertEqual([event['seq'] for event in ring.since(0)], [4, 5])
+
+    def test_since(self):
+        ring = EventRing(max_events=3)
+        self.fill(ring, 5)
+        self.assertEqual([event['seq'] for event in ring.since(3)], [4, 5])
+        self.assertEqual(ring.since(5), [])
+        # Events 2 and 3 were pushed out; the caller sees the gap from the first seq returned
+        self.assertEqual(ring.since(1)[0]['seq'], 3)
+
+
+class TimerWheelTests(SimpleTestCase):
+    async def test_fires_in_deadline_order(self):
+        timers = TimerWheel()
+        fired = []
+        timers.call_later(0.03, fired.append, 'c')
+        timers.call_later(0.01, fired.append, 'a')
+        timers.call_later(0.02, fired.append, 'b')
+        await asyncio.sleep(0.06)
+        self.assertEqual(fired, ['a', 'b', 'c'])
+        self.assertEqual(len(timers), 0)
+
+    async def test_cancelled_timers_do_not_fire(self):
+        timers = TimerWheel()
+        fired = []
+        timers.call_later(0.01, fired.append, 'a').cancel()
+        timers.call_later(0.02, fired.append, 'b')
+        await asyncio.sleep(0.04)
+        self.assertEqual(fired, ['b'])
+
+    async def test_coroutine_callbacks_are_spawned(self):
+        timers = TimerWheel()
+        done = asyncio.Event()
+
+        async def callback():
+            done.set()
+
+        timers.call_later(0.01, callback)
+        await asyncio.wait_for(done.wait(), 1)
+
+    async def test_failing_callback_does_not_stop_the_rest(self):
+        timers = TimerWheel()
+        fired = []
+        timers.call_later(0.01, lambda: 1 / 0)
+        timers.call_later(0.01, fired.append, 'a')
+        await asyncio.sleep(0.03)
+        self.assertEqual(fired, ['a'])
+
+
+class RoomIdAllocatorTests(SimpleTestCase):
+    def test_ids_are_unique_and_time_ordered(self):
+        allocator = RoomIdAllocator(node=3)
+        # More than one second's worth of sequence numbers
+        ids = [allocator.next_id() for _ in range(allocator.sequence_size + 10)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertTrue(all(len(room_id) == 9 and room_id.isalpha() and room_id.isupper() for room_id in ids))
+        self.assertTrue(all(room_id[6] == 'D' for room_id in ids))
+        prefixes = [room_id[:6] for room_id in ids]
+        self.assertEqual(prefixes, sorted(prefixes))
+
+    def test_nodes_never_clash(self):
+        first, second = RoomIdAllocator(node=0), RoomIdAllocator(node=1)
+        ids = [first.next_id() for _ in range(100)] + [second.next_id() for _ in range(100)]
+        self.assertEqual(len(set(ids)), len(ids))
+
+
+class EmojiMatchTests(SimpleTestCase):
+    def test_spellings_of_the_same_emoji_match(self):
+        cases = [
+            # (guess, emoji in the catalog)
+            ('🛏', '🛏️'),  # without VS16
+            ('✈\ufe0e', '✈️'),  # text presentation selector
+            ('🏃', '🏃‍♂️'),  # without the ZWJ gender sign
+            ('🏃‍♀️', '🏃‍♂️'),  # the other gender sign
+            ('👮🏽', '👮'),  # skin tone
+            ('👨🏿‍🍳', '👨‍🍳'),  # skin tone inside a ZWJ sequence
+            (' 🐶 ', '🐶'),
+        ]
+        for guess, emoji in cases:
+            with self.subTest(guess=guess):
+                self.assertTrue(catalog.matches(guess, emoji))
+
+    def test_different_emojis_do_not_match(self):
+        for guess, emoji in (('🐱', '🐶'), ('👩‍🍳', '👨‍🍳'), ('👨', '👨‍🍳')):
+            with self.subTest(guess=guess):
+                self.assertFalse(catalog.matches(guess, emoji))
+
+    def test_listed_twice_is_one_emoji(self):
+        # 🛏️ is in both actions and objects
+        self.assertEqual(catalog.emojis.count('🛏️'), 1)
+        self.assertEqual(catalog.category('🛏'), 'actions')
+        self.assertEqual(len(catalog), len({normalize(e) for entries in charadesCategories.values() for e in entries}))
+
+    def test_guesses_outside_the_catalog(self):
+        for guess in ('🦄', 'dog', '', None, 42, ['🐶']):
+            with self.subTest(guess=guess):
+                self.assertNotIn(guess, catalog)
+                self.assertIsNone(catalog.index_of(guess))
+                self.assertFalse(catalog.matches(guess, '🐶'))
+
+
+class PackLibraryTests(SimpleTestCase):
+    def test_missing_index_offers_only_charades(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'emoji_packs.idx')
+            with override_settings(EMOJI_PACK_INDEX=path):
+                library = PackLibrary()
+                with self.assertLogs('main.packs', 'WARNING'):
+                    self.assertEqual(library.names(), ('charades',))
+                with self.assertRaises(KeyError):
+                    library.get('smileys')
+                # Workers never build the index themselves
+                self.assertFalse(os.path.exists(path))
+
+    def test_built_index(self):
+        if source_path() is None:
+            self.skipTest('random_unicode_emoji is not installed')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'emoji_packs.idx')
+            call_command('buildemojipacks', output=path, stdout=io.StringIO())
+            with override_settings(EMOJI_PACK_INDEX=path):
+                library = PackLibrary()
+                self.assertIn('smileys', library.names())
+                self.assertIn('😀', library.get('smileys').emojis)
+                library._index.close()
+
+
+class DeckTests(SimpleTestCase):
+    def test_no_repeat_within_a_pass(self):
+        deck = Deck('animals')
+        drawn = [deck.draw() for _ in range(10)]
+        self.assertCountEqual(drawn, charadesCategories['animals'])
+
+    def test_reshuffle_never_starts_with_the_last_emoji(self):
+        deck = Deck('animals')
+        last = None
+        for _ in range(50):
+            drawn = [deck.draw() for _ in range(10)]
+            self.assertNotEqual(drawn[0], last)
+            last = drawn[-1]
+
+    def test_restores_from_deck_state(self):
+        deck = Deck('animals')
+        for _ in range(3):
+            deck.draw()
+        restored = Deck.loads(deck.dumps())
+        self.assertEqual((restored.pack, restored.name), ('charades', 'animals'))
+        self.assertEqual([restored.draw() for _ in range(7)], [deck.draw() for _ in range(7)])
+
+    def test_restores_state_written_before_packs(self):
+        # "name:seed:position", from before decks had a pack
+        restored = Deck.loads('animals:1234:3')
+        self.assertEqual((restored.pack, restored.name, restored.position), ('charades', 'animals', 3))
+        expected = Deck('animals', 1234, 3)
+        self.assertEqual([restored.draw() for _ in range(7)], [expected.draw() for _ in range(7)])
+
+    def test_unreadable_state_starts_a_fresh_deck(self):
+        self.assertEqual(Deck.loads('', name='animals').name, 'animals')
+        self.assertEqual(Deck.loads('nodeck:1:2').name, 'all')
+        self.assertEqual(Deck.loads('charades/animals:x:2').name, 'animals')
+
+    @override_settings(EMOJI_DECKS={'zoo': {'animals': 2, 'vehicles': 1}})
+    def test_weighted_deck(self):
+        decks._pools.clear()
+        self.addCleanup(decks._pools.clear)
+        for seed in range(200):
+            deck = Deck('zoo', seed)
+            drawn = [deck.draw() for _ in range(30)]
+            counts = collections.Counter(drawn)
+            self.assertEqual({counts[emoji] for emoji in charadesCategories['animals']}, {2})
+            self.assertEqual({counts[emoji] for emoji in charadesCategories['vehicles']}, {1})
+            # Copies never land back to back
+            self.assertTrue(all(a != b for a, b in zip(drawn, drawn[1:])), seed)
+        self.assertFalse(deck_exists('zoo', 'unknown'))
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_rate(self):
+        with mock.patch('main.ratelimit.time.monotonic', return_value=100.0) as monotonic:
+            bucket = TokenBucket(rate=2, burst=3)
+            self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+            self.assertAlmostEqual(bucket.retry_after(), 0.5)
+            monotonic.return_value = 100.5
+            self.assertTrue(bucket.take())
+            self.assertFalse(bucket.take())
+            # Saved up tokens stop at burst
+            monotonic.return_value = 200
+            self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+
+    @override_settings(GUESS_RATE_LIMIT={'socket_rate': 0, 'room_rate': 5, 'room_burst': 0})
+    def test_guess_bucket_settings(self):
+        self.assertIsNone(guess_bucket('socket'))
+        bucket = guess_bucket('room')
+        self.assertEqual((bucket.rate, bucket.burst), (5, 1))
+
+
+class GuessRateLimitTests(TransactionTestCase):
+    def tearDown(self):
+        reset_loop_state()
+        registry.rooms.clear()
+
+    @override_settings(GUESS_RATE_LIMIT={'socket_rate': 0.001, 'socket_burst': 2, 'room_rate': 0})
+    async def test_one_rate_limited_reply_per_burst(self):
+        communicator = await connect()
+        await communicator.receive_json_from()
+        for _ in range(5):
+            await communicator.send_json_to({'type': 'submit_guess', 'guess': '🐶'})
+        replies = [await communicator.receive_json_from() for _ in range(3)]
+        self.assertEqual([reply['type'] for reply in replies], ['guess_result', 'guess_result', 'rate_limited'])
+        self.assertGreater(replies[2]['retry_after'], 0)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    @override_settings(GUESS_RATE_LIMIT={'socket_rate': 0, 'room_rate': 0.001, 'room_burst': 2},
+                       GUESS_BATCH_WINDOW=0)
+    async def test_wrong_guesses_past_the_room_budget_stay_with_the_guesser(self):
+        room_id, (alice, bob) = await open_room('alice', 'bob')
+        await alice.send_json_to({'type': 'start_game'})
+        await alice.receive_json_from()
+        await bob.receive_json_from()
+        room = registry.rooms[room_id]
+        wrong = next(emoji for emoji in room.deck.catalog.emojis if not room.deck.catalog.matches(emoji, room.currentEmoji))
+
+        for _ in range(4):
+            await bob.send_json_to({'type': 'submit_guess', 'guess': wrong})
+        received = [(await bob.receive_json_from())['type'] for _ in range(6)]
+        self.assertEqual(collections.Counter(received), {'guess_result': 4, 'guess_submitted': 2})
+        self.assertEqual([(await alice.receive_json_from())['type'] for _ in range(2)], ['guess_submitted'] * 2)
+        self.assertTrue(await alice.receive_nothing())
+
+        # A right guess is always broadcast
+        await bob.send_json_to({'type': 'submit_guess', 'guess': room.currentEmoji})
+        self.assertEqual((await alice.receive_json_from())['type'], 'guess_submitted')
+        await alice.disconnect()
+        await bob.disconnect()
+
+
+class GuessBatchTests(SimpleTestCase):
+    def tearDown(self):
+        reset_loop_state()
+
+    async def listen(self, room):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(fanout.group_name(room), channel)
+        self.addCleanup(layer.groups.pop, fanout.group_name(room), None)
+        return lambda: layer.receive(channel)
+
+    def guess(self, username, guess, correct=False):
+        return {'type': 'guess_submitted', 'username': username, 'guess': guess, 'correct': correct}
+
+    @override_settings(GUESS_BATCH_WINDOW=10)
+    async def test_right_guess_flushes_pending_wrong_guesses_first(self):
+        room = RoomState('BATCHROOM', participants=('a', 'b', 'c'))
+        receive = await self.listen(room)
+        await fanout.broadcast_guess(room, self.guess('b', '🐱'))
+        await fanout.broadcast_guess(room, self.guess('c', '🐍'))
+        await fanout.broadcast_guess(room, self.guess('b', '🐶', correct=True))
+
+        batch = await receive()
+        self.assertEqual(batch['type'], 'guesses_broadcast')
+        payload = json.loads(batch['batch']['text'])
+        self.assertEqual(payload['guesses'], [['b', '🐱'], ['c', '🐍']])
+        self.assertEqual([json.loads(single['text'])['guess'] for single in batch['single']], ['🐱', '🐍'])
+        right = json.loads((await receive())['frames']['text'])
+        self.assertEqual((right['guess'], right['correct']), ('🐶', True))
+        self.assertGreater(right['seq'], payload['seq'])
+        self.assertIsNone(room.guess_flush)
+
+    @override_settings(GUESS_BATCH_WINDOW=0.02)
+    async def test_wrong_guesses_go_out_after_the_window(self):
+        room = RoomState('BATCHROOM', participants=('a', 'b'))
+        receive = await self.listen(room)
+        await fanout.broadcast_guess(room, self.guess('b', '🐱'))
+        await fanout.broadcast_guess(room, self.guess('b', '🐍'))
+        batch = await asyncio.wait_for(receive(), 1)
+        self.assertEqual(json.loads(batch['batch']['text'])['guesses'], [['b', '🐱'], ['b', '🐍']])
+        self.assertEqual(room.pending_guesses, [])
+
+
+class TurnTests(SimpleTestCase):
+    """Game flow on a RoomState alone; the database writes it schedules are never flushed."""
+
+    def tearDown(self):
+        reset_loop_state()
+
+    def make_room(self, players=('a', 'b', 'c'), rounds=2):
+        room = RoomState('TESTROOMA', rounds=rounds, participants=players)
+        self.assertTrue(services.start_game(room))
+        return room
+
+    def guess_right(self, room):
+        guesser = next(name for name in room.participants if name != room.currentTurn)
+        return services.submit_guess(room, guesser, room.currentEmoji)
+
+    async def test_every_player_acts_once_per_round(self):
+        room = self.make_room()
+        actors = [room.currentTurn]
+        for _ in range(5):
+            correct, points, ended = self.guess_right(room)
+            self.assertTrue(correct)
+            self.assertEqual(points, services.GUESS_POINTS)
+            self.assertIsNone(ended[1])
+            actors.append(room.currentTurn)
+        self.assertEqual(actors, ['a', 'b', 'c', 'a', 'b', 'c'])
+        self.assertEqual(room.currentRound, 2)
+
+        _, _, (turn_ended, game_over) = self.guess_right(room)
+        self.assertEqual(game_over['type'], 'game_over')
+        self.assertEqual(room.gameState, 'finished')
+        self.assertIsNone(room.game)
+
+    async def test_players_who_left_are_skipped(self):
+        room = self.make_room()
+        services.leave_room(room, 'b')
+        self.guess_right(room)
+        self.assertEqual(room.currentTurn, 'c')
+
+    async def test_late_joiner_acts_from_next_round(self):
+        room = self.make_room(players=('a', 'b'))
+        room.add_participant('d')
+        self.guess_right(room)
+        self.assertEqual(room.currentTurn, 'b')
+        self.guess_right(room)
+        self.assertEqual((room.currentRound, room.currentTurn), (2, 'a'))
+        self.guess_right(room)
+        self.guess_right(room)
+        self.assertEqual(room.currentTurn, 'd')
+
+    async def test_stale_expiry_does_not_end_the_next_turn(self):
+        room = self.make_room()
+        # The deadline fired, but its task runs only after a right guess moved the game on
+        stale = services.end_turn(room, 'timeout', room.turn_id)
+        self.guess_right(room)
+        self.assertEqual(room.currentTurn, 'b')
+        await stale
+        self.assertEqual(room.currentTurn, 'b')
+
+    async def test_current_expiry_ends_the_turn(self):
+        room = self.make_room()
+        await services.end_turn(room, 'timeout', room.turn_id)
+        self.assertEqual(room.currentTurn, 'b')
+
+    async def test_last_leaver_puts_room_back_to_waiting(self):
+        room = self.make_room(players=('a', 'b'))
+        emoji = room.currentEmoji
+        services.leave_room(room, 'a')
+        services.leave_room(room, 'b')
+        self.assertIsNone(room.game)
+        self.assertEqual((room.gameState, room.currentTurn, room.currentEmoji), ('waiting', None, None))
+
+        room.add_participant('c')
+        self.assertEqual(services.submit_guess(room, 'c', emoji), (False, 0, None))
+
+
+class CodecTests(SimpleTestCase):
+    def test_msgpack_round_trip(self):
+        values = [
+            None, True, False, 0, 127, 128, 255, 256, 65535, 65536, 2 ** 32, 2 ** 63 - 1,
+            -1, -32, -33, -128, -129, -32768, -32769, -2 ** 31, -2 ** 63, 1.5,
+            '', 'a' * 31, 'b' * 32, 'é' * 300, '🎉' * 20000, b'', b'\x00' * 300,
+            [], list(range(16)), {'a': [1, {'b': None}]}, {str(n): n for n in range(20)},
+        ]
+        for value in values:
+            self.assertEqual(unpackb(packb(value)), value)
+
+    def test_compact_round_trip_uses_short_keys(self):
+        payload = {'type': 'guess_submitted', 'username': 'bob', 'guess': '🐶', 'correct': False,
+                   'room_id': 'ABCDEFGHI', 'unknown_field': 1}
+        data = COMPACT.pack(payload)
+        self.assertLess(len(data), len(JSON.encode(payload)['text_data'].encode()))
+        self.assertEqual(COMPACT.unpack(data), payload)
+        self.assertEqual(decode(bytes_data=data), payload)
+
+    def test_derived_fields_are_left_out(self):
+        payload = {'type': 'guess_result', 'correct': True, 'message': 'Correct!'}
+        self.assertEqual(COMPACT.unpack(COMPACT.pack(payload)), {'type': 'guess_result', 'correct': True})
+
+    def test_frames_encode_each_format_once(self):
+        encoded = frames({'type': 'time_left', 'time_left': 5})
+        self.assertEqual(JSON.frame(encoded), {'text_data': encoded['text']})
+        self.assertEqual(COMPACT.frame(encoded), {'bytes_data': encoded['bytes']})
+        # A worker with no compact sockets sent only text
+        text_only = frames({'type': 'time_left', 'time_left': 5}, compact=False)
+        self.assertEqual(COMPACT.frame(text_only), {'bytes_data': encoded['bytes']})
+
+    def test_malformed_frames_raise_protocol_error(self):
+        bad = [
+            b'',
+            b'\xc1',
+            b'\xa5ab',
+            b'\xd9\x10abc',
+            b'\x81\xa1a',
+            b'\x91\xc0\xc0',
+            b'\xa2\xff\xfe',
+            b'\x81\x91\x01\x01',
+            b'\x91' * 5000 + b'\xc0',
+            b'\xdc\x00\x01' * 5000 + b'\xc0',
+        ]
+        for data in bad:
+            with self.assertRaises(ProtocolError, msg=data[:8]):
+                unpackb(data)
+
+    def test_decode_rejects_non_messages(self):
+        for text in ('[1,2]', '"user"', '3', 'null', '{}', '{"type": 3}', '[' * 100000 + ']' * 100000):
+            with self.assertRaises(ValueError, msg=text[:8]):
+                decode(text_data=text)
+        for data in (packb([1, 2]), packb({1: 'x'}), packb({0: None})):
+            with self.assertRaises(ProtocolError):
+                decode(bytes_data=data)
+        with self.assertRaises(ValueError):
+            decode(text_data='{"type": ')
+        self.assertEqual(decode(text_data='{"type": "user", "username": "a"}'), {'type': 'user', 'username': 'a'})
+
+
+class MalformedInputTests(SimpleTestCase):
+    async def test_socket_survives_malformed_frames(self):
+        communicator = await connect()
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connection_ready')
+        for frame in ({'text_data': '[1,2]'}, {'text_data': '{"no": "type"}'},
+                      {'bytes_data': b'\x91' * 5000 + b'\xc0'}):
+            await communicator.send_to(**frame)
+            self.assertEqual(await communicator.receive_json_from(),
+                             {'type': 'error', 'message': 'Malformed message'})
+        await communicator.disconnect()
+
+    @override_settings(ROOM_WORKERS=['127.0.0.1:8001', '127.0.0.1:8002'], WORKER_ADDRESS='127.0.0.1:8001')
+    async def test_join_with_non_string_room_id(self):
+        communicator = await connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'user', 'username': 'alice'})
+        for room_id in (12345, None, ['ABCDEFGHI']):
+            await communicator.send_json_to({'type': 'join_room', 'room_id': room_id})
+            self.assertEqual(await communicator.receive_json_from(),
+                             {'type': 'error', 'message': 'Room does not exist'})
+        await communicator.disconnect()
+
+
+class UsernameTests(TransactionTestCase):
+    def tearDown(self):
+        reset_loop_state()
+        registry.rooms.clear()
+
+    async def test_invalid_usernames_get_an_error(self):
+        communicator = await connect()
+        await communicator.receive_json_from()
+        for message in ({'type': 'user'}, {'type': 'user', 'username': ''},
+                        {'type': 'user', 'username': ['bob']}, {'type': 'user', 'username': 'b' * 101}):
+            await communicator.send_json_to(message)
+            self.assertEqual(await communicator.receive_json_from(),
+                             {'type': 'error', 'message': 'Invalid username'})
+        await communicator.send_json_to({'type': 'create_room'})
+        self.assertEqual(await communicator.receive_json_from(),
+                         {'type': 'error', 'message': 'Send a username first'})
+        await communicator.disconnect()
+        self.assertEqual(registry.rooms, {})
+
+    async def test_create_room_checks_username_before_registering(self):
+        for username in (['bob'], '', None):
+            with self.assertRaises(ValueError):
+                await services.create_room(username)
+        self.assertEqual(registry.rooms, {})
+        self.assertFalse(await Room.objects.aexists())
+
+    @override_settings(RESUME_GRACE=0)
+    async def test_no_rename_inside_a_room(self):
+        communicator = await connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'user', 'username': 'bob'})
+        await communicator.send_json_to({'type': 'create_room'})
+        room_id = (await communicator.receive_json_from())['room_id']
+        await communicator.receive_json_from()
+        room = registry.rooms[room_id]
+
+        await communicator.send_json_to({'type': 'user', 'username': 'bobby'})
+        self.assertEqual(await communicator.receive_json_from(),
+                         {'type': 'error', 'message': 'Cannot change username while in a room'})
+        await communicator.disconnect()
+        self.assertEqual(room.participants, [])
+
+
+class ResumeTests(TransactionTestCase):
+    def tearDown(self):
+        reset_loop_state()
+        registry.rooms.clear()
+
+    @override_settings(RESUME_GRACE=5)
+    async def test_resume_within_grace_keeps_the_roster(self):
+        room_id, (alice, bob) = await open_room('alice', 'bob')
+        await bob.disconnect()
+        self.assertTrue(await alice.receive_nothing(0.1))
+
+        bob = await connect(f'/ws/room/?resume_token={make_token(room_id, "bob")}')
+        resumed = await bob.receive_json_from()
+        self.assertEqual((resumed['type'], resumed['username'], resumed['participants']),
+                         ('resumed', 'bob', ['alice', 'bob']))
+        self.assertEqual(registry.rooms[room_id].departing, {})
+        # Nobody heard of bob leaving or coming back
+        self.assertTrue(await alice.receive_nothing(0.1))
+        await alice.disconnect()
+        await bob.disconnect()
+
+    @override_settings(RESUME_GRACE=0.05)
+    async def test_departure_after_grace(self):
+        room_id, (alice, bob) = await open_room('alice', 'bob')
+        await bob.disconnect()
+        left = await alice.receive_json_from(timeout=1)
+        self.assertEqual((left['type'], left['action'], left['participants']),
+                         ('participants_updated', 'user_left', ['alice']))
+
+        bob = await connect()
+        await bob.receive_json_from()
+        await bob.send_json_to({'type': 'resume', 'resume_token': make_token(room_id, 'bob')})
+        self.assertEqual(await bob.receive_json_from(), {'type': 'error', 'message': 'Session cannot be resumed'})
+        await alice.disconnect()
+        await bob.disconnect()
+
+
+class OneStepConnectTests(TransactionTestCase):
+    def tearDown(self):
+        reset_loop_state()
+        registry.rooms.clear()
+
+    async def test_joined_room_is_the_first_frame(self):
+        room_id, (alice,) = await open_room('alice')
+        for path in (f'/ws/room/{room_id}/?username=bob', f'/ws/room/?room={room_id}&username=carol'):
+            with self.subTest(path=path):
+                communicator = await connect(path)
+                joined = await communicator.receive_json_from()
+                self.assertEqual((joined['type'], joined['room_id']), ('joined_room', room_id))
+                self.assertIn('resume_token', joined)
+                self.assertEqual((await alice.receive_json_from())['action'], 'user_joined')
+                await communicator.disconnect()
+        await alice.disconnect()
+
+    async def test_resume_token_and_seq(self):
+        room_id, (alice, bob) = await open_room('alice', 'bob')
+        await alice.send_json_to({'type': 'start_game'})
+        started = await bob.receive_json_from()
+        await alice.receive_json_from()
+        await bob.disconnect()
+
+        bob = await connect(f'/ws/room/?resume_token={make_token(room_id, "bob")}&seq={started["seq"] - 1}')
+        self.assertEqual((await bob.receive_json_from())['type'], 'resumed')
+        replayed = await bob.receive_json_from()
+        self.assertEqual((replayed['type'], replayed['seq']), ('game_started', started['seq']))
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_unknown_room(self):
+        communicator = await connect('/ws/room/NOSUCHROOM/?username=bob')
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'message': 'Room does not exist'})
+        await communicator.disconnect()
+
+
+class RosterLogTests(SimpleTestCase):
+    def test_changes_merge(self):
+        room = RoomState('ROSTER')
+        for username in ('alice', 'bob'):
+            room.add_participant(username)
+        room.remove_participant('bob')
+        room.add_participant('carol')
+        room.remove_participant('alice')
+        room.add_participant('alice')
+
+        self.assertEqual(room.roster_version, 6)
+        self.assertEqual(room.roster_changes_since(0), (['carol', 'alice'], []))
+        # bob came and went, alice went and came back
+        self.assertEqual(room.roster_changes_since(1), (['carol'], []))
+        self.assertEqual(room.roster_changes_since(4), ([], []))
+        self.assertEqual(room.roster_changes_since(6), ([], []))
+        room.remove_participant('carol')
+        self.assertEqual(room.roster_changes_since(6), ([], ['carol']))
+
+    def test_snapshot_fallback(self):
+        with mock.patch.object(RoomState, 'roster_log_size', 2):
+            room = RoomState('ROSTER')
+        for username in ('alice', 'bob', 'carol'):
+            room.add_participant(username)
+        self.assertEqual(room.roster_changes_since(1), (['bob', 'carol'], []))
+        # The change after version 0 has fallen out of the log
+        self.assertIsNone(room.roster_changes_since(0))
+        # A version this room never reached
+        self.assertIsNone(room.roster_changes_since(4))
+
+
+class MetricsViewTests(SimpleTestCase):
+    def test_disabled(self):
+        with mock.patch.object(metrics, 'enabled', False):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_prometheus_text(self):
+        with mock.patch.object(metrics, 'enabled', True):
+            metrics.broadcasts.inc('room_broadcast')
+            response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE mimic_broadcasts_total counter', body)
+        self.assertIn('mimic_broadcasts_total{event="room_broadcast"}', body)
+        self.assertIn('mimic_rooms ', body)
+
+
+class RoomRegistryTests(TransactionTestCase):
+    def setUp(self):
+        self.registry = RoomRegistry()
+
+    def tearDown(self):
+        if self.registry._flush_handle is not None:
+            self.registry._flush_handle.cancel()
+
+    async def test_flush_writes_changes(self):
+        room = await self.registry.create()
+        room.add_participant('alice')
+        room.add_participant('bob')
+        room.update(gameState='finished', currentRound=2)
+        room.pending_scores['alice'] = 3
+        self.registry.save(room)
+        await self.registry.flush()
+
+        row = await Room.objects.aget(id=room.id)
+        self.assertEqual((row.gameState, row.currentRound), ('finished', 2))
+        members = [pair async for pair in row.members.order_by('id').values_list('username', 'score')]
+        self.assertEqual(members, [('alice', 3), ('bob', 0)])
+        self.assertEqual((room.changed_fields, room.pending_roster, room.pending_scores), (set(), {}, {}))
+
+        room.remove_participant('bob')
+        room.remove_participant('alice')
+        self.registry.save(room)
+        await self.registry.flush()
+        self.assertFalse(await row.members.aexists())
+        # Flushed and empty, so no longer held in memory
+        self.assertNotIn(room.id, self.registry.rooms)
+
+    async def test_failed_flush_keeps_changes(self):
+        room = await self.registry.create()
+        room.add_participant('alice')
+        room.update(currentRound=1)
+        self.registry.save(room)
+        with mock.patch.object(store, 'update_room', side_effect=OperationalError('disk I/O error')):
+            with self.assertRaises(OperationalError):
+                await self.registry.flush()
+        self.assertEqual((room.changed_fields, room.pending_roster), ({'currentRound'}, {'alice': True}))
+        self.assertIn(room.id, self.registry._dirty)
+
+        await self.registry.flush()
+        self.assertEqual((await Room.objects.aget(id=room.id)).currentRound, 1)
+
+    async def test_load(self):
+        row = await Room.objects.acreate(id='LOADROOM', gameState='in_progress', currentTurn='bob', currentRound=2)
+        for username in ('bob', 'alice'):
+            await row.members.acreate(username=username)
+
+        # Joins racing for a cold room share one load
+        first, second = await asyncio.gather(self.registry.get('LOADROOM'), self.registry.get('LOADROOM'))
+        self.assertIs(first, second)
+        self.assertEqual((first.participants, first.currentRound), (['bob', 'alice'], 2))
+        # The game died with the worker that ran it
+        self.assertEqual((first.gameState, first.currentTurn), ('waiting', None))
+        self.assertIn('LOADROOM', self.registry._dirty)
+
+        with self.assertRaises(Room.DoesNotExist):
+            await self.registry.get('NOSUCHROOM')
+
+
+class RosterSyncTests(TransactionTestCase):
+    def tearDown(self):
+        reset_loop_state()
+        registry.rooms.clear()
+
+    async def test_bad_versions_get_an_error(self):
+        communicator = await connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'user', 'username': 'alice'})
+        await communicator.send_json_to({'type': 'create_room'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'room_created')
+        await communicator.receive_json_from()
+
+        for version in ('x', None, [1], 1e999):
+            await communicator.send_json_to({'type': 'roster_sync', 'version': version})
+            self.assertEqual(await communicator.receive_json_from(),
+                             {'type': 'error', 'message': 'Invalid roster version'})
+        await communicator.send_json_to({'type': 'roster_sync', 'version': '0'})
+        reply = await communicator.receive_json_from()
+        self.assertEqual((reply['type'], reply['added'], reply['version']), ('participants_updated', ['alice'], 1))
+        await communicator.disconnect()
+
+
+class ParticipantMigrationTests(TransactionTestCase):
+    before = ('main', '0003_room_currentemoji_room_currentturn_room_gamestate')
+    after = ('main', '0004_participant')
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        executor.loader.build_graph()
+        return executor.loader.project_state([target]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('main'))
+
+    def test_roster_moves_to_participant_rows_and_back(self):
+        Room = self.migrate(self.before).get_model('main', 'Room')
+        Room.objects.create(id='LISTROOMA', participants=['bob', 'alice', 'bob'])
+        Room.objects.create(id='LISTROOMB', participants=[])
+
+        Participant = self.migrate(self.after).get_model('main', 'Participant')
+        rows = Participant.objects.order_by('id').values_list('room_id', 'username')
+        self.assertEqual(list(rows), [('LISTROOMA', 'bob'), ('LISTROOMA', 'alice')])
+
+        Room = self.migrate(self.before).get_model('main', 'Room')
+        self.assertEqual(Room.objects.get(id='LISTROOMA').participants, ['bob', 'alice'])
+
+
+class ReaperTests(TransactionTestCase):
+    def tearDown(self):
+        reset_loop_state()
+        registry.rooms.clear()
+
+    def make_room(self, room_id, idle, gameState='waiting', members=()):
+        room = Room.objects.create(id=room_id, gameState=gameState, last_active=timezone.now() - idle)
+        for username in members:
+            room.members.create(username=username)
+        return room
+
+    def test_expires_by_last_activity(self):
+        self.make_room('EMPTYIDLE', timedelta(minutes=20))
+        self.make_room('EMPTYBUSY', timedelta(minutes=1))
+        self.make_room('DONEROOMA', timedelta(hours=2), 'finished', ['alice'])
+        self.make_room('PLAYROOMA', timedelta(hours=2), 'in_progress', ['bob'])
+        # Left behind with players by a worker that went away
+        self.make_room('GHOSTROOM', timedelta(days=2), 'in_progress', ['carol'])
+
+        self.assertEqual(reap_batch(), 3)
+        self.assertEqual(set(Room.objects.values_list('id', flat=True)), {'EMPTYBUSY', 'PLAYROOMA'})
+        self.assertEqual(Participant.objects.count(), 1)
+
+    async def test_flush_marks_room_active(self):
+        room, _ = await services.create_room('alice')
+        await Room.objects.filter(id=room.id).aupdate(last_active=timezone.now() - timedelta(days=2))
+        room.update(currentRound=1)
+        registry.save(room)
+        await registry.flush()
+        last_active = (await Room.objects.aget(id=room.id)).last_active
+        self.assertLess(timezone.now() - last_active, timedelta(minutes=1))
+
+    def test_batch_size(self):
+        Room.objects.bulk_create([Room(id=f'OLDROOM{n:02d}') for n in range(5)])
+        Room.objects.update(last_active=timezone.now() - timedelta(days=2))
+        self.assertEqual(reap_batch(2), 2)
+        self.assertEqual(Room.objects.count(), 3)
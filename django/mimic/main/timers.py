@@ -0,0 +1,100 @@
+import asyncio
+import heapq
+import itertools
+
+from .log import get_logger
+
+log = get_logger(__name__)
+
+_tasks = set()
+
+
+def spawn(coro):
+    """Run coro in the background, keeping a reference so it isn't collected mid-flight."""
+    task = asyncio.ensure_future(coro)
+    _tasks.add(task)
+    task.add_done_callback(_task_done)
+    return task
+
+
+def _task_done(task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error('background_task_failed', error=repr(task.exception()))
+
+
+class Timer:
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    All deadlines of a worker in one heap, fired from a single event loop
+    handle for the earliest one. Cancelled timers stay in the heap and are
+    skipped when they come up, so cancel is O(1) and scheduling O(log n).
+
+    Callbacks may be plain functions or coroutine functions; coroutines are
+    spawned as tasks.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._handle = None
+        self._handle_when = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(asyncio.get_running_loop().time() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        timer = Timer(when, callback, args)
+        heapq.heappush(self._heap, (when, next(self._counter), timer))
+        self._arm()
+        return timer
+
+    def _arm(self):
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = self._handle_when = None
+            return
+        when = self._heap[0][0]
+        if self._handle is not None:
+            if self._handle_when <= when:
+                return
+            self._handle.cancel()
+        self._handle = asyncio.get_running_loop().call_at(when, self._fire)
+        self._handle_when = when
+
+    def _fire(self):
+        self._handle = self._handle_when = None
+        now = asyncio.get_running_loop().time()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, timer = heapq.heappop(self._heap)
+            if timer.cancelled:
+                continue
+            try:
+                result = timer.callback(*timer.args)
+            except Exception as e:
+                log.error('timer_callback_failed', error=repr(e))
+                continue
+            if asyncio.iscoroutine(result):
+                spawn(result)
+        self._arm()
+
+
+wheel = TimerWheel()
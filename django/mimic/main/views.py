@@ -1,2 +1,10 @@
-from django.shortcuts import render
+from django.http import Http404, HttpResponse
 
+from .metrics import metrics
+
+
+async def metrics_view(request):
+    """This worker's metrics in the Prometheus text format."""
+    if not metrics.enabled:
+        raise Http404('Metrics are disabled')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
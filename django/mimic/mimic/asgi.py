@@ -11,12 +11,15 @@ django_asgi_app = get_asgi_application()
 # Now import your middleware and routing after Django is set up
 
 from mimic.routing import websocket_urlpatterns
+from main.affinity import RoomAffinityMiddleware
 
 application = ProtocolTypeRouter({
     'http': django_asgi_app,
     'websocket': AllowedHostsOriginValidator(
+        RoomAffinityMiddleware(
             URLRouter(
                 websocket_urlpatterns
             )
+        )
     )
 })
\ No newline at end of file
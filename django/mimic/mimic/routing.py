@@ -1,6 +1,14 @@
 from django.urls import re_path
 from main.consumer import RoomConsumer
 
+# Clients offering the "mimic.compact.v1" subprotocol get MessagePack binary
+# frames (see main.protocol); everyone else keeps JSON text frames.
+#
+# ws/room/<room_id>/?username=<name> (or ws/room/?room=<room_id>&username=<name>)
+# joins the room while connecting and sends joined_room as the first frame;
+# ?resume_token= does the same for a resume. Without them the client gets
+# connection_ready and sends user and join_room itself.
 websocket_urlpatterns = [
     re_path(r'ws/room/$', RoomConsumer.as_asgi()),
+    re_path(r'ws/room/(?P<room_id>[A-Z]+)/$', RoomConsumer.as_asgi()),
 ]
\ No newline at end of file
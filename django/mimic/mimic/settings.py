@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -74,12 +75,110 @@ WSGI_APPLICATION = 'mimic.wsgi.application'
 ASGI_APPLICATION = "mimic.asgi.application"
 
 # Channel Layers Configuration for Django Channels
+# main.layers.LocalChannelLayer serves a single process without copying group messages.
+# Room groups are the only groups, and with ROOM_WORKERS every socket of a room is on
+# the room's worker, so it serves several workers too.
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+        "BACKEND": "main.layers.LocalChannelLayer"
     }
 }
 
+# Daphne workers behind `manage.py rundispatcher`, e.g.
+# "127.0.0.1:8001,127.0.0.1:8002". Each worker sets WORKER_ADDRESS to its own
+# entry; every room is then pinned to one worker and its sockets all land there.
+ROOM_WORKERS = [worker for worker in os.environ.get('ROOM_WORKERS', '').split(',') if worker]
+WORKER_ADDRESS = os.environ.get('WORKER_ADDRESS')
+
+# Node letter of the room ids this process allocates (0-25). Processes with
+# different nodes can never produce the same id; unset means random per
+# process, with a retry on the rare clash.
+if 'ROOM_ID_NODE' in os.environ:
+    ROOM_ID_NODE = int(os.environ['ROOM_ID_NODE'])
+elif WORKER_ADDRESS in ROOM_WORKERS:
+    ROOM_ID_NODE = ROOM_WORKERS.index(WORKER_ADDRESS)
+else:
+    ROOM_ID_NODE = None
+
+
+# Seconds between the authoritative time_left broadcasts of running rounds
+ROUND_TICK_INTERVAL = 5
+
+# Extra weighted decks hosts can pick on create_room, as {name: {category: copies per shuffle}}.
+# 'all' and one deck per category in main.emojis always exist.
+EMOJI_DECKS = {}
+
+# Index of the Unicode emoji packs. Build it with `manage.py buildemojipacks` on deploy, next to
+# migrate; workers without it offer only the charades pack
+EMOJI_PACK_INDEX = os.environ.get('EMOJI_PACK_INDEX', BASE_DIR / 'emoji_packs.idx')
+
+# Token buckets for submit_guess: guesses a second and burst, per socket and per room.
+# Guesses over a socket's limit are dropped with a rate_limited reply; wrong guesses over
+# the room's limit are only answered to the guesser, not broadcast. A rate of 0 disables a limit.
+# Keys set here override main.ratelimit.DEFAULTS.
+GUESS_RATE_LIMIT = {}
+
+# Seconds wrong guesses are held to go out together as one guesses_batch; 0 sends each at once
+GUESS_BATCH_WINDOW = 0.075
+
+# Outbound queue of each socket (main.outbox). Past feed_limit queued activity frames
+# (wrong guesses, time_left) the oldest are dropped; game state is always delivered.
+# A socket whose queue hasn't drained for slow_after seconds, or that has more than
+# state_limit state frames queued, is closed with code 4008. Under Daphne, frames stay
+# queued here while Daphne holds more than buffer_limit unread bytes for the socket
+# (plain TCP only; behind TLS Daphne's own buffer is the only bound).
+# Keys set here override main.outbox.DEFAULTS.
+SOCKET_OUTBOX = {}
+
+# Seconds a player whose socket dropped stays in their room. A socket that sends the
+# resume_token from room_created/joined_room in that time (or joins again) takes their
+# place without a roster change; 0 makes every disconnect an immediate leave.
+RESUME_GRACE = 15
+
+# Recent broadcasts each room keeps, numbered by seq, for {'type': 'replay', 'seq': n}
+# (main.replay): at most this many events and bytes of encoded frames per room.
+# Keys set here override main.replay.DEFAULTS.
+ROOM_EVENT_RING = {}
+
+# Expiry of rooms deleted by `manage.py reaprooms`, in seconds since the room's state
+# was last written: empty rooms, finished games, and any room idle for max_age.
+# Keys set here override main.reaper.DEFAULTS.
+ROOM_REAPER = {}
+
+
+# Logging
+# Game code logs structured events through main.log; the handler writes from a
+# background thread so the event loop never blocks on it. MIMIC_LOG_LEVEL=DEBUG
+# includes every received message, sampled per LOG_SAMPLING.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {'()': 'main.log.StructuredFormatter'},
+    },
+    'handlers': {
+        'queue': {
+            'class': 'main.log.QueueingHandler',
+            'formatter': 'structured',
+        },
+    },
+    'loggers': {
+        'main': {
+            'handlers': ['queue'],
+            'level': os.environ.get('MIMIC_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Fraction of each event type that is logged; events not listed are always logged
+LOG_SAMPLING = {
+    'message_received': 0.01,
+}
+
+# Prometheus metrics at /metrics (MIMIC_METRICS=1); when off, instrumentation costs next to nothing
+METRICS_ENABLED = os.environ.get('MIMIC_METRICS', '') == '1'
 
 
 # Database
@@ -6,19 +6,25 @@ const WebSocketContext = createContext(null);
 export const WebSocketProvider = ({ children }) => {
   const [isConnected, setIsConnected] = useState(false);
   const [connectionStatus, setConnectionStatus] = useState('connecting');
+  // Room the socket is opened for, and the room of the socket that is open now
+  const [roomId, setRoomId] = useState(null);
+  const [socketRoomId, setSocketRoomId] = useState(null);
   const wsRef = useRef(null);
   const listenersRef = useRef(new Map());
   const { username, isUsernameSet, setRandomUsername } = useUsername();
 
   useEffect(() => {
     const WEBSOCKET_URL = import.meta.env.VITE_WEBSOCKET_URL || 'wss://5.78.154.173:8001';
-    const socket = new WebSocket(`${WEBSOCKET_URL}/ws/room/`); // Fixed URL path
+    // ws/room/<id>/ reaches the worker that owns the room when there are several
+    const path = roomId ? `/ws/room/${roomId}/` : '/ws/room/';
+    const socket = new WebSocket(`${WEBSOCKET_URL}${path}`);
     wsRef.current = socket;
 
     socket.onopen = () => {
       console.log('WebSocket connected');
       setIsConnected(true);
       setConnectionStatus('connected');
+      setSocketRoomId(roomId);
       
       // Automatically send username when connection is established
       const currentUsername = username || setRandomUsername();
@@ -32,6 +38,8 @@ export const WebSocketProvider = ({ children }) => {
     };
     
     socket.onclose = () => {
+      // A socket replaced by one for another room closes after its successor opened
+      if (wsRef.current !== socket) return;
       console.log('WebSocket disconnected');
       setIsConnected(false);
       setConnectionStatus('disconnected');
@@ -47,6 +55,13 @@ export const WebSocketProvider = ({ children }) => {
       
       try {
         const data = JSON.parse(event.data);
+
+        // The room is served by another worker: reopen the socket on its path, where pages join again
+        if (data.type === 'error' && data.reconnect && data.room_id) {
+          console.log('Reconnecting for room:', data.room_id);
+          setRoomId(data.room_id);
+          return;
+        }
         
         // Call all listeners for this message type
         const messageListeners = listenersRef.current.get(data.type) || [];
@@ -74,15 +89,19 @@ export const WebSocketProvider = ({ children }) => {
     };
 
     return () => {
+      setIsConnected(false);
+      setSocketRoomId(null);
       socket.close();
     };
-  }, [username]); // Add username as dependency to re-send if it changes
+  }, [username, roomId]); // Reconnect to re-send the username, or to reach another room's worker
 
   return (
     <WebSocketContext.Provider value={{ 
       ws: wsRef.current, 
       isConnected, 
       connectionStatus,
+      socketRoomId,
+      connectToRoom: setRoomId,
       sendMessage: (message) => {
         if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
           wsRef.current.send(JSON.stringify(message));
@@ -10,12 +10,14 @@ const Room = () => {
   const [searchParams] = useSearchParams();
   const roomCodeFromQuery = searchParams.get('roomCode');
   
-  const { addEventListener, sendMessage, isConnected } = useWebSocket();
+  const { addEventListener, sendMessage, isConnected, socketRoomId, connectToRoom } = useWebSocket();
   const { username } = useUsername();
   
   // Determine if we're joining or creating
   const roomIdToJoin = roomIdFromParams || roomCodeFromQuery;
   const isJoining = !!roomIdToJoin;
+  // Only well-formed room ids have a ws/room/<id>/ path; others join over the plain socket and get an error
+  const roomPath = isJoining && /^[A-Z]+$/.test(roomIdToJoin) ? roomIdToJoin : null;
   
   // Room state
   const [roomData, setRoomData] = useState(null);
@@ -199,16 +201,25 @@ const Room = () => {
     };
   }, [addEventListener]);
 
+  // Open the socket on the room's own path, so it lands on the worker that owns the room
+  useEffect(() => {
+    if (roomPath) {
+      connectToRoom(roomPath);
+    }
+  }, [roomPath, connectToRoom]);
+
   // Create or join room when component mounts
   useEffect(() => {
     if (isConnected && !roomData) {
       if (isJoining) {
-        handleJoinRoom();
+        if (socketRoomId === roomPath) {
+          handleJoinRoom();
+        }
       } else {
         handleCreateRoom();
       }
     }
-  }, [isConnected, isJoining]);
+  }, [isConnected, isJoining, socketRoomId]);
 
   const handleCreateRoom = () => {
     if (!isConnected) {